@@ -0,0 +1,148 @@
+"""How long it takes to import the integration when Home Assistant loads it.
+
+The modules Home Assistant has already imported when it loads a integration
+are imported first, then only the import of the integration is timed. Every
+sample is a new python process so nothing is cached between samples.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --compare benchmarks/results/<earlier>.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = Path(__file__).resolve().parent / "results"
+
+MARKER = "-- avfallsor import starts --"
+HA_MODULES = [
+    "homeassistant.config_entries",
+    "homeassistant.core",
+    "homeassistant.components.sensor",
+    "homeassistant.helpers.aiohttp_client",
+    "homeassistant.helpers.config_validation",
+    "homeassistant.helpers.entity",
+    "homeassistant.helpers.storage",
+    "voluptuous",
+]
+INTEGRATION_MODULES = [
+    "custom_components.avfallsor",
+    "custom_components.avfallsor.sensor",
+    "custom_components.avfallsor.config_flow",
+]
+HEAVY_MODULES = ["bs4", "html5lib", "lxml"]
+
+CODE = f"""
+import json, sys, time
+{"; ".join(f"import {m}" for m in HA_MODULES)}
+sys.stderr.write({MARKER!r} + "\\n")
+start = time.perf_counter()
+{"; ".join(f"import {m}" for m in INTEGRATION_MODULES)}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def sample(importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    proc = subprocess.run(
+        cmd + ["-c", CODE], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def top_imports(stderr, count):
+    """The slowest modules imported by the integration, by self time."""
+    lines = stderr.split(MARKER, 1)[-1].splitlines()
+    modules = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        if self_us.strip().isdigit():
+            modules.append((int(self_us), name.strip()))
+    return [
+        {"module": name, "self_ms": us / 1000}
+        for us, name in sorted(modules, reverse=True)[:count]
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--samples", type=int, default=10)
+    args.add_argument("--output", type=Path, help="where to write the json result")
+    args.add_argument("--compare", type=Path, help="earlier json result")
+    opts = args.parse_args()
+
+    timings = []
+    loaded = []
+    for _ in range(opts.samples):
+        result, _ = sample()
+        timings.append(result["seconds"])
+        loaded = result["loaded"]
+    _, stderr = sample(importtime=True)
+
+    result = {
+        "samples": len(timings),
+        "p50_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "heavy_modules_loaded": loaded,
+        "top_imports": top_imports(stderr, 10),
+    }
+
+    print(
+        f"Integration import p50 {result['p50_ms']:.1f}ms "
+        f"min {result['min_ms']:.1f}ms max {result['max_ms']:.1f}ms"
+    )
+    print(f"Heavy modules imported: {', '.join(loaded) or 'none'}")
+    for item in result["top_imports"]:
+        print(f"  {item['self_ms']:>8.2f}ms {item['module']}")
+
+    output = opts.output or RESULTS / (
+        datetime.now().strftime("import-%Y%m%d-%H%M%S") + ".json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "created": datetime.now().isoformat(),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": {"import": result},
+            },
+            indent=2,
+        )
+    )
+    print(f"\nWrote {output}")
+
+    if opts.compare:
+        before = json.loads(opts.compare.read_text())["results"]["import"]
+        change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+        print(
+            f"p50 before {before['p50_ms']:.1f}ms now {result['p50_ms']:.1f}ms "
+            f"({change:+.1f}%)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
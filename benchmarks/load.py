@@ -0,0 +1,207 @@
+"""Load test the integration in a real Home Assistant against the stand-in server.
+
+Starts benchmarks/standin_server.py in process, boots a minimal Home
+Assistant (http only) pointed at it, adds a config entry per synthetic
+address and then refreshes every entry a few times with the refresh
+service. Needs homeassistant installed, it is not a dependency of the repo.
+
+    python benchmarks/load.py --entries 200 --latency 50 --jitter 20
+    python benchmarks/load.py --entries 500 --error-rate 0.05 --output load.json
+
+Setting up the entries fetches every page, so the refresh rounds after that
+should be 304s. Set --bump to change every calendar before the last round.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import standin_server
+from homeassistant import auth, bootstrap, config_entries, core, loader
+from homeassistant.setup import async_setup_component
+
+from custom_components.avfallsor import DOMAIN, fetch, utils
+
+HA_CONFIG = {
+    "homeassistant": {
+        "latitude": 58.1467,
+        "longitude": 7.9956,
+        "time_zone": "Europe/Oslo",
+    },
+}
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    last = len(values) - 1
+    return {
+        "p50_ms": round(values[int(last * 0.5)], 3),
+        "p99_ms": round(values[int(last * 0.99)], 3),
+        "max_ms": round(values[-1], 3),
+        "mean_ms": round(statistics.fmean(values), 3),
+    }
+
+
+async def start_hass(config_dir, port):
+    hass = core.HomeAssistant(config_dir)
+    loader.async_setup(hass)
+    hass.auth = await auth.auth_manager_from_config(
+        hass, [{"type": "homeassistant"}], []
+    )
+    config = dict(HA_CONFIG, http={"server_port": port})
+    await bootstrap.async_from_config_dict(config, hass)
+    assert await async_setup_component(hass, DOMAIN, {})
+    return hass
+
+
+def entry(number, garbage_types):
+    address = f"{standin_server.STREET} {number + 1}"
+    return config_entries.ConfigEntry(
+        version=1,
+        minor_version=1,
+        domain=DOMAIN,
+        title=address,
+        data={"address": address, "garbage_types": garbage_types},
+        source=config_entries.SOURCE_USER,
+    )
+
+
+def snapshot(datas):
+    return {id(data): dict(data.stats) for data in datas}
+
+
+def stats_since(datas, before):
+    total = {}
+    for data in datas:
+        for key, value in data.stats.items():
+            total[key] = total.get(key, 0) + value - before[id(data)].get(key, 0)
+    return total
+
+
+async def refresh_round(hass, datas, standin, name):
+    before = snapshot(datas)
+    requests = sum(standin.requests.values())
+    start = perf_counter()
+    await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True)
+    elapsed = perf_counter() - start
+    fetch = [
+        data.timings.last["fetch"] for data in datas if "fetch" in data.timings.last
+    ]
+    parse = [
+        data.timings.last["parse"] for data in datas if "parse" in data.timings.last
+    ]
+    result = {
+        "round": name,
+        "seconds": round(elapsed, 3),
+        "refreshes_per_second": round(len(datas) / elapsed, 1),
+        "server_requests": sum(standin.requests.values()) - requests,
+        "stats": stats_since(datas, before),
+        "fetch": percentiles(fetch),
+        "parse": percentiles(parse),
+    }
+    # Clear them so the next round does not report these again.
+    for data in datas:
+        data.timings.last.clear()
+    return result
+
+
+async def run(opts):
+    standin = standin_server.StandIn(
+        max(opts.streets, opts.entries),
+        latency=opts.latency,
+        jitter=opts.jitter,
+        error_rate=opts.error_rate,
+        bad_request_rate=opts.bad_request_rate,
+        padding=opts.padding,
+    )
+    runner, url = await standin_server.start(standin)
+    utils.AVFALLSOR_URL = utils.GEONORGE_URL = url
+
+    results = {
+        "python": platform.python_version(),
+        "entries": opts.entries,
+        "settings": dict(standin.settings),
+        "rounds": [],
+    }
+    with tempfile.TemporaryDirectory() as config_dir:
+        start = perf_counter()
+        hass = await start_hass(config_dir, opts.http_port)
+        results["boot_seconds"] = round(perf_counter() - start, 3)
+
+        try:
+            entries = [entry(n, opts.garbage_types) for n in range(opts.entries)]
+            start = perf_counter()
+            await asyncio.gather(*(hass.config_entries.async_add(e) for e in entries))
+            await hass.async_block_till_done()
+            elapsed = perf_counter() - start
+            loaded = [
+                e for e in entries if e.state is config_entries.ConfigEntryState.LOADED
+            ]
+            datas = list(hass.data[DOMAIN].get("entries", {}).values())
+            results["setup"] = {
+                "seconds": round(elapsed, 3),
+                "loaded": len(loaded),
+                "with_calendar": sum(bool(data.index) for data in datas),
+                "entities": len(hass.states.async_entity_ids()),
+            }
+
+            for data in datas:
+                data.timings.enabled = True
+            for n in range(opts.rounds):
+                if opts.bump and n == opts.rounds - 1:
+                    standin.settings["version"] += 1
+                name = f"refresh {n + 1}"
+                results["rounds"].append(
+                    await refresh_round(hass, datas, standin, name)
+                )
+        finally:
+            await hass.async_stop(force=True)
+            await runner.cleanup()
+
+    results["server_requests"] = dict(standin.requests)
+    # Every request the integration made, from the histograms in fetch.py.
+    results["latency"] = fetch.latency_diagnostics()
+    return results
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--entries", type=int, default=100)
+    args.add_argument("--streets", type=int, default=5000)
+    args.add_argument("--rounds", type=int, default=3)
+    args.add_argument(
+        "--bump", action="store_true", help="change the calendars before the last round"
+    )
+    args.add_argument("--garbage-types", nargs="+", default=["bio", "paper"])
+    args.add_argument("--latency", type=float, default=0, help="ms per request")
+    args.add_argument("--jitter", type=float, default=0, help="extra random ms")
+    args.add_argument("--error-rate", type=float, default=0, help="share of 500s")
+    args.add_argument("--bad-request-rate", type=float, default=0, help="share of 400s")
+    args.add_argument("--padding", type=int, default=0, help="kB of junk per page")
+    args.add_argument("--http-port", type=int, default=18123)
+    args.add_argument("--output", help="write the results as json to this file")
+    args.add_argument("--verbose", action="store_true")
+    opts = args.parse_args()
+
+    logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+    results = asyncio.run(run(opts))
+
+    print(json.dumps(results, indent=2))
+    if opts.output:
+        Path(opts.output).write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
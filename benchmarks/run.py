@@ -0,0 +1,454 @@
+"""Offline benchmarks for the hot functions in custom_components.avfallsor.
+
+Everything runs against the recorded pages and api responses in
+benchmarks/fixtures, no network is used. The results are written as json so
+a later run can be compared with an earlier one:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --compare benchmarks/results/<earlier>.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+RESULTS = Path(__file__).resolve().parent / "results"
+
+sys.path.insert(0, str(ROOT))
+
+from custom_components.avfallsor import fetch, parser, utils
+
+PAGES = [
+    "tommeplan",
+    "tommeplan_malformed",
+    "tommeplan_rollover",
+    "tommeplan_no_calendar",
+    "tommeplan_large",
+    "tommeplan_large_tail",
+    "tommeplan_multiyear",
+]
+LARGE_PAGES = ("tommeplan_large", "tommeplan_large_tail")
+# Chunk sizes the streaming parser must give the same result for.
+STREAM_CHUNKS = (7, 1024, fetch.CHUNK_SIZE)
+WEEKDAYS = ["Mandag", "Tirsdag", "Onsdag", "Torsdag", "Fredag", "Lørdag", "Søndag"]
+MONTHS = {number: name for name, number in utils.months_no.items()}
+# Synthetic calendars start tomorrow and have a pickup every week.
+MULTIYEAR_YEARS = 3
+BACKENDS = [None, parser.BACKEND_HTML5LIB] + (
+    [parser.BACKEND_LXML] if parser.HAS_LXML else []
+)
+
+
+def heading_for(day):
+    return f"{WEEKDAYS[day.weekday()]} {day.day}. {MONTHS[day.month]}"
+
+
+def synthetic_dates(years, start=None):
+    start = start or datetime.combine(datetime.now().date(), datetime.min.time())
+    return [start + timedelta(days=1 + 7 * week) for week in range(52 * years)]
+
+
+def synthetic_page(dates):
+    """A tømmeplan page with a bio pickup on every date, without years like the real one."""
+    items = "".join(
+        f'<h3>{heading_for(day)}</h3><div><span class="waste-icon waste-icon--bio">'
+        f"</span></div>\n"
+        for day in dates
+    )
+    return f'<main><div class="pickup-days-large">\n{items}</div></main>'
+
+
+def legacy_dates(headings, today):
+    """How the dates were found before, parse_date and a compare with today."""
+    dates = []
+    for value in headings:
+        date = utils.parse_date(value)
+        if today > date:
+            date = utils.parse_date(value, year=date.year + 1)
+        dates.append(date)
+    return dates
+
+
+def load_page(name):
+    if name == "tommeplan_multiyear":
+        return synthetic_page(synthetic_dates(MULTIYEAR_YEARS))
+    if name == "tommeplan_large":
+        # A big page is the normal page with lots of extra markup around the
+        # calendar, this is what we get when the site adds menus, news etc.
+        text = (FIXTURES / "tommeplan.html").read_text(encoding="utf-8")
+        filler = '<div class="news"><p>Nyhet <a href="#">les mer</a></p></div>\n'
+        return text.replace("<main", filler * 5000 + "<main", 1)
+    if name == "tommeplan_large_tail":
+        # The same markup after the calendar, the streaming parser can stop
+        # reading before it.
+        text = (FIXTURES / "tommeplan.html").read_text(encoding="utf-8")
+        filler = '<div class="news"><p>Nyhet <a href="#">les mer</a></p></div>\n'
+        return text.replace("</main>", filler * 5000 + "</main>", 1)
+    return (FIXTURES / f"{name}.html").read_text(encoding="utf-8")
+
+
+def load_json(name):
+    return json.loads((FIXTURES / f"{name}.json").read_text(encoding="utf-8"))
+
+
+class RecordedChunks:
+    """Like aiohttp iter_chunked, a plain iterator and not a async generator."""
+
+    def __init__(self, body, size):
+        self._body = body
+        self._size = size
+        self._offset = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._offset >= len(self._body):
+            raise StopAsyncIteration
+        start = self._offset
+        self._offset += self._size
+        return self._body[start : self._offset]
+
+
+class RecordedResponse:
+    def __init__(self, status, data):
+        self.status = status
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        self._body = data.encode("utf-8")
+        self.headers = {}
+        self.charset = "utf-8"
+        self.content_length = len(self._body)
+        self.content = self
+        # Like aiohttp when the whole body has arrived.
+        self.connection = None
+
+    def iter_chunked(self, size):
+        return RecordedChunks(self._body, size)
+
+    async def readany(self):
+        return b""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class RecordedClient:
+    """Replays a recorded response for every request."""
+
+    def __init__(self, status, data):
+        self._response = RecordedResponse(status, data)
+
+    def get(self, url, **kwargs):
+        return self._response
+
+
+def measure(func, iterations):
+    """Run func and return the latencies in seconds and the peak memory."""
+    func()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, peak
+
+
+def measure_async(coro_func, iterations):
+    loop = asyncio.new_event_loop()
+    try:
+        return measure(lambda: loop.run_until_complete(coro_func()), iterations)
+    finally:
+        loop.close()
+
+
+def summary(timings, peak):
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "iterations": len(timings),
+        "ops_per_sec": len(timings) / total if total else None,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        "peak_memory_kib": peak / 1024,
+    }
+
+
+def streamed_items(text, chunk_size):
+    stream = parser.PickupDaysStream()
+    data = text.encode("utf-8")
+    for start in range(0, len(data), chunk_size):
+        if stream.feed(data[start : start + chunk_size]):
+            break
+    stream.close()
+    if stream.items is None:
+        return parser.parse_pickup_days(stream.text)
+    return stream.items
+
+
+def check_equivalence():
+    """All the parser backends and the streaming parser must give the same calendar."""
+    failed = []
+    for page in PAGES:
+        text = load_page(page)
+        expected = dict(utils.parse_tomme_kalender(text, backend=BACKENDS[1]))
+        for backend in BACKENDS:
+            got = dict(utils.parse_tomme_kalender(text, backend=backend))
+            if got != expected:
+                failed.append(f"{page} backend={backend or 'auto'}")
+        for chunk_size in STREAM_CHUNKS:
+            got = dict(utils.pickup_calendar(streamed_items(text, chunk_size)))
+            if got != expected:
+                failed.append(f"{page} stream chunk_size={chunk_size}")
+    return failed
+
+
+def check_year_rollover():
+    """The dates of synthetic calendars over many years must come out right."""
+    failed = []
+    for years in (1, 2, MULTIYEAR_YEARS):
+        # Start on different days so we cross new year at different places.
+        for offset in (0, 100, 200, 300):
+            today = datetime(2025, 1, 1) + timedelta(days=offset)
+            expected = synthetic_dates(years, today)
+            got = utils.parse_tomme_kalender(synthetic_page(expected), today=today)
+            if got.get("bio") != expected:
+                failed.append(f"{years} years from {today.date()}")
+    return failed
+
+
+def cases(scale):
+    parse_n = max(1, 50 * scale)
+    for page in PAGES:
+        text = load_page(page)
+        for backend in BACKENDS:
+            n = parse_n if page not in LARGE_PAGES else max(1, parse_n // 10)
+            yield (
+                f"parse_tomme_kalender[{page},{backend or 'auto'}]",
+                lambda text=text, backend=backend: utils.parse_tomme_kalender(
+                    text, backend=backend
+                ),
+                n,
+                False,
+            )
+
+    # Time to a PickupIndex from the response, reading the whole page and
+    # parsing it or parsing it as it arrives and stopping after the calendar.
+    for page in ("tommeplan", *LARGE_PAGES):
+        client = RecordedClient(200, load_page(page))
+        n = parse_n if page not in LARGE_PAGES else max(1, parse_n // 10)
+
+        async def full(client=client):
+            page = await utils.fetch_tommeplan_page("1", client)
+            return utils.parse_pickup_index(page.text)
+
+        async def stream(client=client):
+            page = await utils.fetch_tommeplan_page("1", client, stream=True)
+            if page.items is None:
+                return utils.parse_pickup_index(page.text)
+            return utils.PickupIndex(utils.pickup_calendar(page.items))
+
+        yield (f"fetch_tommeplan_page[{page},full]", full, n, True)
+        yield (f"fetch_tommeplan_page[{page},stream]", stream, n, True)
+
+    headings = ["Fredag 7. mars", "Lørdag 27. desember", "Mandag 5. januar 2026"]
+    for heading in headings:
+        yield (
+            f"parse_date[{heading}]",
+            lambda heading=heading: utils.parse_date(heading),
+            2000 * scale,
+            False,
+        )
+
+    today = datetime.now()
+    headings = [heading_for(day) for day in synthetic_dates(MULTIYEAR_YEARS)]
+    yield (
+        f"HeadingDates[{len(headings)} headings]",
+        lambda: list(map(utils.HeadingDates(today), headings)),
+        100 * scale,
+        False,
+    )
+    yield (
+        f"legacy_dates[{len(headings)} headings]",
+        lambda: legacy_dates(headings, today),
+        100 * scale,
+        False,
+    )
+
+    for page in ("tommeplan", "tommeplan_rollover"):
+        calendar = utils.parse_tomme_kalender(load_page(page))
+        for gbt, dates in sorted(calendar.items()):
+            yield (
+                f"find_next_garbage_pickup[{page},{gbt}]",
+                lambda dates=dates: utils.find_next_garbage_pickup(dates),
+                2000 * scale,
+                False,
+            )
+
+        index = utils.PickupIndex(calendar)
+        for gbt in sorted(calendar):
+            yield (
+                f"PickupIndex.next_pickup[{page},{gbt}]",
+                lambda index=index, gbt=gbt: index.next_pickup(gbt),
+                2000 * scale,
+                False,
+            )
+            day = index.next_pickup(gbt)
+            yield (
+                f"PickupIndex.has_pickup[{page},{gbt}]",
+                lambda index=index, gbt=gbt, day=day: index.has_pickup(gbt, day),
+                2000 * scale,
+                False,
+            )
+
+    # What it costs to keep the calendars for many addresses in bulk mode,
+    # see peak_memory_kib. The dict is how the calendar was kept before.
+    calendar = utils.parse_tomme_kalender(load_page("tommeplan_rollover"))
+    addresses = 1000
+    yield (
+        f"calendar_dict[{addresses} addresses]",
+        lambda: [
+            {gbt: [d.replace() for d in dates] for gbt, dates in calendar.items()}
+            for _ in range(addresses)
+        ],
+        max(1, 5 * scale),
+        False,
+    )
+    yield (
+        f"PickupIndex[{addresses} addresses]",
+        lambda: [utils.PickupIndex(calendar) for _ in range(addresses)],
+        max(1, 5 * scale),
+        False,
+    )
+
+    lookups = [
+        ("address", 200, "address", "Kongeveien 1, Kristiansand"),
+        ("address_short", 200, "address", "Kongeveien 10"),
+        ("address_empty", 200, "address_empty", "Finnesikke 99"),
+    ]
+    for name, status, fixture, address in lookups:
+        client = RecordedClient(status, load_json(fixture))
+        yield (
+            f"find_id[{name}]",
+            lambda client=client, address=address: utils.find_id(address, client),
+            500 * scale,
+            True,
+        )
+
+    client = RecordedClient(200, load_json("punktsok"))
+    yield (
+        "find_address_from_lat_lon[punktsok]",
+        lambda client=client: utils.find_address_from_lat_lon(58.1467, 7.9956, client),
+        500 * scale,
+        True,
+    )
+
+    client = RecordedClient(400, load_json("punktsok_400"))
+
+    async def outside_norway(client=client):
+        try:
+            await utils.find_address_from_lat_lon(59.9, 30.3, client)
+        except ValueError:
+            pass
+
+    yield ("find_address_from_lat_lon[400]", outside_norway, 500 * scale, True)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    print(f"\n{'benchmark':<60} {'p50 before':>11} {'p50 now':>11} {'change':>8}")
+    for name, now in results.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        change = (now["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+        print(
+            f"{name:<60} {before['p50_ms']:>9.3f}ms {now['p50_ms']:>9.3f}ms {change:>+7.1f}%"
+        )
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--scale", type=int, default=1, help="multiply iterations")
+    args.add_argument("--filter", default="", help="only run matching benchmarks")
+    args.add_argument("--output", type=Path, help="where to write the json result")
+    args.add_argument("--compare", type=Path, help="earlier json result")
+    opts = args.parse_args()
+
+    # The warnings about missing addresses are expected and only slow us down.
+    logging.getLogger("custom_components.avfallsor").setLevel(logging.ERROR)
+
+    failed = check_equivalence()
+    if failed:
+        print(f"Parser backends do not agree on: {', '.join(failed)}")
+        return 1
+
+    failed = check_year_rollover()
+    if failed:
+        print(f"Wrong dates for the synthetic calendars: {', '.join(failed)}")
+        return 1
+
+    results = {}
+    for name, func, iterations, is_async in cases(opts.scale):
+        if opts.filter not in name:
+            continue
+        runner = measure_async if is_async else measure
+        results[name] = summary(*runner(func, iterations))
+        r = results[name]
+        print(
+            f"{name:<60} {r['ops_per_sec']:>10.1f}/s p50 {r['p50_ms']:.3f}ms "
+            f"p99 {r['p99_ms']:.3f}ms peak {r['peak_memory_kib']:.1f}KiB"
+        )
+
+    output = opts.output or RESULTS / (
+        datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "created": datetime.now().isoformat(),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"\nWrote {output}")
+
+    if opts.compare:
+        compare(results, json.loads(opts.compare.read_text())["results"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""Stand-in for avfallsor.no and ws.geonorge.no, for load and soak tests.
+
+Serves a generated tømmeplan for thousands of synthetic street ids, and the
+address and punktsok apis that lead to them. Latency, errors (500) and bad
+requests (400) can be injected.
+
+    python benchmarks/standin_server.py --port 8099 --streets 5000 --latency 50
+    AVFALLSOR_URL=http://127.0.0.1:8099 GEONORGE_URL=http://127.0.0.1:8099 hass
+
+The street ids are uuids of the street number, street 0 is
+00000000-0000-0000-0000-000000000000, and its address is "Syntetisk vei 1,
+Kristiansand". Any other street id gets the page without a calendar, like
+the real site.
+
+GET /_control shows the settings and request counts, POST /_control with a
+json object changes the settings. Bump "version" to change every calendar.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+sys.path.insert(0, str(ROOT))
+
+from custom_components.avfallsor import parser, utils
+
+WEEKDAYS = ["Mandag", "Tirsdag", "Onsdag", "Torsdag", "Fredag", "Lørdag", "Søndag"]
+MONTHS = {number: name for name, number in utils.months_no.items()}
+# What is picked up in week 0, 1, 2, 3 and then again.
+ROTATION = [("bio", "mixed"), ("paper",), ("bio", "plastic"), ("metal",)]
+WEEKS = 12
+STREET = "Syntetisk vei"
+ADDRESS = re.compile(rf"{STREET} (\d+)", re.IGNORECASE)
+# Coordinates outside this box get a 400, like for places outside Norway.
+NORWAY = ((57.9, 71.2), (4.5, 31.2))
+
+SETTINGS = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "error_rate": 0.0,
+    "bad_request_rate": 0.0,
+    # Makes the pages this much bigger with junk after the calendar, in kB.
+    "padding": 0,
+    "version": 0,
+}
+
+
+def street_id(number):
+    return str(uuid.UUID(int=number))
+
+
+def street_number(value, streets):
+    try:
+        number = uuid.UUID(value).int
+    except ValueError:
+        return None
+    return number if number < streets else None
+
+
+def pickup_block(number, version, today):
+    """The div.pickup-days-large block for a street, it starts on a weekday set by the number."""
+    weekday = (number + version) % 5
+    first = today + timedelta(days=(weekday - today.weekday()) % 7 or 7)
+    lines = [f'<div class="{parser.CALENDAR_CLASS}">']
+    for week in range(WEEKS):
+        day = first + timedelta(weeks=week)
+        lines.append(
+            f"  <h3>{WEEKDAYS[day.weekday()]} {day.day}. {MONTHS[day.month]}</h3>"
+        )
+        lines.append('  <div class="pickup-day">')
+        for gbt in ROTATION[(week + number) % len(ROTATION)]:
+            name = utils.gb_map[gbt]
+            lines.append(
+                f'    <span class="{parser.ICON_CLASS} {parser.ICON_CLASS}--{gbt}" '
+                f'title="{name}"></span>'
+            )
+            lines.append(f'    <span class="waste-name">{name}</span>')
+        lines.append("  </div>")
+    lines.append("</div>")
+    return "\n".join(lines)
+
+
+class StandIn:
+    def __init__(self, streets, **settings):
+        self.streets = streets
+        self.settings = dict(SETTINGS, **settings)
+        self.requests = Counter()
+        template = (FIXTURES / "tommeplan.html").read_text(encoding="utf-8")
+        block = parser.extract_pickup_block(template)
+        self._head, self._tail = template.split(block)
+        self._pages = {}
+        self._no_calendar = (FIXTURES / "tommeplan_no_calendar.html").read_text(
+            encoding="utf-8"
+        )
+
+    def page(self, number, version, today, padding=0):
+        key = (number, version, today, padding)
+        if key not in self._pages:
+            if len(self._pages) > 4096:
+                self._pages.clear()
+            block = pickup_block(number, version, today)
+            # About a kB per div, after the calendar like the rest of the page.
+            junk = '<div class="padding"><p>' + "Avfall Sør " * 90 + "</p></div>\n"
+            self._pages[key] = self._head + block + junk * padding + self._tail
+        return self._pages[key]
+
+    @web.middleware
+    async def count(self, request, handler):
+        response = await handler(request)
+        route = request.match_info.route.name or request.path
+        self.requests[f"{route} {response.status}"] += 1
+        return response
+
+    async def inject(self):
+        """Sleep for the latency and maybe fail, returns the status to use."""
+        settings = self.settings
+        delay = settings["latency"] + random.uniform(0, settings["jitter"])
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        roll = random.random()
+        if roll < settings["error_rate"]:
+            status = 500
+        elif roll < settings["error_rate"] + settings["bad_request_rate"]:
+            status = 400
+        else:
+            status = 200
+        return status
+
+    async def tommeplan(self, request):
+        status = await self.inject()
+        if status != 200:
+            return web.Response(status=status, text="Feil")
+
+        number = street_number(request.match_info["street_id"], self.streets)
+        if number is None:
+            return web.Response(text=self._no_calendar, content_type="text/html")
+
+        today = date.today()
+        version = self.settings["version"]
+        etag = f'"{number}-{version}-{today.isoformat()}"'
+        headers = {"ETag": etag}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        response = web.Response(
+            text=self.page(number, version, today, self.settings["padding"]),
+            content_type="text/html",
+            headers=headers,
+        )
+        # gzip or deflate, like the real site, if the client asks for it.
+        response.enable_compression()
+        return response
+
+    async def address(self, request):
+        status = await self.inject()
+        if status != 200:
+            return web.Response(status=status, text="Feil")
+
+        match = ADDRESS.fullmatch(request.query.get("lookup_term", "").strip())
+        if match is None or not 0 < int(match.group(1)) <= self.streets:
+            # The api gives a empty list when nothing is found.
+            return web.json_response([])
+
+        number = int(match.group(1)) - 1
+        value = f"{STREET} {number + 1}"
+        href = f"{request.url.origin()}/henting-av-avfall/finn-hentedag/{street_id(number)}"
+        return web.json_response(
+            {"0": {"label": f"{value}, Kristiansand", "value": value, "href": href}}
+        )
+
+    async def punktsok(self, request):
+        status = await self.inject()
+        try:
+            lat = float(request.query["lat"])
+            lon = float(request.query["lon"])
+        except (KeyError, ValueError):
+            status = 400
+        else:
+            (lat_min, lat_max), (lon_min, lon_max) = NORWAY
+            if not (lat_min <= lat <= lat_max and lon_min <= lon <= lon_max):
+                status = 400
+        if status == 400:
+            return web.json_response(
+                {"status": 400, "message": "Koordinatene er utenfor Norge"}, status=400
+            )
+        if status != 200:
+            return web.Response(status=status, text="Feil")
+
+        number = hash((round(lat, 4), round(lon, 4))) % self.streets
+        text = f"{STREET} {number + 1}"
+        return web.json_response(
+            {
+                "adresser": [
+                    {
+                        "adressetekst": text,
+                        "adressetekstutenadressetilleggsnavn": text,
+                        "kommunenavn": "KRISTIANSAND",
+                    }
+                ]
+            }
+        )
+
+    async def control(self, request):
+        if request.method == "POST":
+            changes = await request.json()
+            unknown = set(changes) - set(SETTINGS)
+            if unknown:
+                return web.json_response({"unknown": sorted(unknown)}, status=400)
+            self.settings.update(changes)
+        return web.json_response(
+            {
+                "streets": self.streets,
+                "settings": self.settings,
+                "requests": dict(self.requests),
+            }
+        )
+
+
+def make_app(standin):
+    app = web.Application(middlewares=[standin.count])
+    app.router.add_get(
+        "/henting-av-avfall/finn-hentedag/{street_id}/",
+        standin.tommeplan,
+        name="tommeplan",
+    )
+    app.router.add_get("/wp-json/addresses/v1/address", standin.address, name="address")
+    app.router.add_get("/adresser/v1/punktsok", standin.punktsok, name="punktsok")
+    app.router.add_route("*", "/_control", standin.control, name="control")
+    return app
+
+
+async def start(standin, host="127.0.0.1", port=0):
+    """Start the server, returns the runner and the base url."""
+    runner = web.AppRunner(make_app(standin), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--host", default="127.0.0.1")
+    args.add_argument("--port", type=int, default=8099)
+    args.add_argument("--streets", type=int, default=5000)
+    args.add_argument("--latency", type=float, default=0, help="ms per request")
+    args.add_argument("--jitter", type=float, default=0, help="extra random ms")
+    args.add_argument("--error-rate", type=float, default=0, help="share of 500s")
+    args.add_argument("--bad-request-rate", type=float, default=0, help="share of 400s")
+    args.add_argument("--padding", type=int, default=0, help="kB of junk per page")
+    opts = args.parse_args()
+
+    standin = StandIn(
+        opts.streets,
+        latency=opts.latency,
+        jitter=opts.jitter,
+        error_rate=opts.error_rate,
+        bad_request_rate=opts.bad_request_rate,
+        padding=opts.padding,
+    )
+    print(f"Serving {opts.streets} streets, settings {json.dumps(standin.settings)}")
+    web.run_app(make_app(standin), host=opts.host, port=opts.port, access_log=None)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
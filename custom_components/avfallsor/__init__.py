@@ -1,8 +1,12 @@
 import logging
 
+import aiohttp
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, SupportsResponse
+from homeassistant.exceptions import ConfigEntryNotReady, HomeAssistantError
 
 DOMAIN = "avfallsor"
 NAME = DOMAIN
@@ -20,6 +24,19 @@ If you have any issues with this you need to open an issue here:
 """.format(name=NAME, version=VERSION, issueurl=ISSUEURL)
 
 garbage_types = ["paper", "bio", "residual", "metal", "plastic", "glass"]
+PLATFORMS = ["sensor", "calendar"]
+
+SERVICE_REFRESH = "refresh"
+REFRESH_SCHEMA = vol.Schema({vol.Optional("street_id"): cv.string})
+SERVICE_HISTORY = "history"
+HISTORY_SCHEMA = vol.Schema(
+    {
+        vol.Optional("street_id"): cv.string,
+        vol.Optional("start"): cv.date,
+        vol.Optional("end"): cv.date,
+        vol.Optional("garbage_type"): cv.string,
+    }
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -27,6 +44,47 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup(hass, config):
     """Set up this component using YAML."""
     _LOGGER.info(STARTUP)
+
+    async def async_handle_refresh(call):
+        """Fetch the calendars now instead of waiting for the next refresh."""
+        from .coordinator import async_refresh_data
+
+        await async_refresh_data(hass, call.data.get("street_id"))
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_REFRESH, async_handle_refresh, schema=REFRESH_SCHEMA
+    )
+
+    async def async_handle_history(call):
+        """The pickups that have happened, per street_id."""
+        from .history import async_get_history
+
+        known = hass.data.get(DOMAIN, {}).get("data", {})
+        street_ids = [call.data["street_id"]] if "street_id" in call.data else known
+        result = {}
+        for street_id in street_ids:
+            if street_id not in known:
+                raise HomeAssistantError(f"{street_id} is not set up")
+            history = await async_get_history(hass, street_id)
+            result[street_id] = history.as_dict(
+                call.data.get("start"),
+                call.data.get("end"),
+                call.data.get("garbage_type"),
+            )
+        return result
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_HISTORY,
+        async_handle_history,
+        schema=HISTORY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+    from .export import AvfallSorScheduleView
+
+    hass.http.register_view(AvfallSorScheduleView())
+
     if config.get(DOMAIN) is None:
         # We get her if the integration is set up using config flow
         return True
@@ -47,12 +105,41 @@ async def async_setup(hass, config):
 
 async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
     """Set up avfallsor as config entry."""
-    hass.async_create_task(
-        hass.config_entries.async_forward_entry_setups(config_entry, ["sensor"])
-    )
+    # coordinator imports DOMAIN from here, so it can't be imported at the top.
+    from .coordinator import DEFAULT_SETUP_TIMEOUT, async_acquire_data
+
+    # Looking up the street_id and waiting for the first calendar share
+    # setup_timeout, 0 only skips the wait for the calendar.
+    timeout = config_entry.data.get("setup_timeout", DEFAULT_SETUP_TIMEOUT)
+    deadline = hass.loop.time() + timeout
+    try:
+        data = await async_acquire_data(
+            hass, config_entry.data, lookup_timeout=timeout or DEFAULT_SETUP_TIMEOUT
+        )
+    except (aiohttp.ClientError, TimeoutError) as err:
+        raise ConfigEntryNotReady(f"Could not look up the street_id: {err}") from err
+    if data is None:
+        raise ConfigEntryNotReady("Could not find the street_id")
+
+    hass.data[DOMAIN].setdefault("entries", {})[config_entry.entry_id] = data
+    await data.async_wait_ready(max(deadline - hass.loop.time(), 0))
+    await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
     return True
 
 
+async def async_unload_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
+    """Unload a config entry, the shared data is removed with the last entry."""
+    from .coordinator import release_data
+
+    unload_ok = await hass.config_entries.async_unload_platforms(
+        config_entry, PLATFORMS
+    )
+    if unload_ok:
+        data = hass.data[DOMAIN]["entries"].pop(config_entry.entry_id)
+        release_data(hass, data.street_id)
+    return unload_ok
+
+
 async def async_remove_entry(hass, config_entry):
     try:
         await hass.config_entries.async_forward_entry_unload(config_entry, "sensor")
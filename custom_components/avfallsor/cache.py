@@ -0,0 +1,148 @@
+"""Calendar and street_id cache that is kept across restarts."""
+
+import logging
+import re
+from datetime import datetime, timedelta
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from . import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = f"{DOMAIN}.cache"
+SAVE_DELAY = 10
+
+# How long we trust a street_id lookup, misses are only kept for a short time
+# as it might be a temporary problem on their side.
+STREET_ID_TTL = timedelta(days=30)
+STREET_ID_MISS_TTL = timedelta(hours=1)
+MAX_STREET_IDS = 512
+
+# Outside Norway, find_id_from_lat_lon raises ValueError for this.
+ERROR_NOT_IN_NORWAY = "not_in_norway"
+
+
+def address_key(address):
+    """Kongeveien  1 ,Kristiansand -> address:kongeveien 1, kristiansand"""
+    address = re.sub(r"\s*,\s*", ", ", address.strip().casefold())
+    address = re.sub(r"\s+", " ", address)
+    return f"address:{address}"
+
+
+def lat_lon_key(lat, lon):
+    """Round to 4 decimals (about 10 meters), the lookup uses a 20 meter radius."""
+    return f"latlon:{float(lat):.4f},{float(lon):.4f}"
+
+
+async def async_get_cache(hass):
+    """Get the shared cache, it is loaded from disk the first time."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    cache = domain_data.get("cache")
+    if cache is None:
+        cache = domain_data["cache"] = AvfallSorCache(hass)
+        cache.loaded = hass.async_create_task(cache.async_load())
+
+    await cache.loaded
+    return cache
+
+
+class AvfallSorCache:
+    """Keeps the last good calendar per street_id and the resolved street_ids."""
+
+    def __init__(self, hass):
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._data = {"calendars": {}, "street_ids": {}}
+        self.loaded = None
+        self.stats = {"street_id_hits": 0, "street_id_misses": 0}
+
+    async def async_load(self):
+        data = await self._store.async_load()
+        if data:
+            self._data.update(data)
+        # Drop anything we don't understand, we will just look it up again.
+        self._data["street_ids"] = {
+            key: value
+            for key, value in self._data["street_ids"].items()
+            if isinstance(value, dict) and "expires" in value
+        }
+        _LOGGER.debug(
+            "Loaded %s cached calendars", len(self._data.get("calendars", {}))
+        )
+
+    @callback
+    def _async_schedule_save(self):
+        self._store.async_delay_save(lambda: self._data, SAVE_DELAY)
+
+    def get_street_id(self, key, allow_expired=False):
+        """Get the cached lookup for key or None.
+
+        The result is a dict with street_id (None if it was a miss) and error.
+        """
+        entry = self._data["street_ids"].get(key)
+        if allow_expired:
+            return entry
+        if entry is None or datetime.fromisoformat(entry["expires"]) < datetime.now():
+            self.stats["street_id_misses"] += 1
+            return None
+        self.stats["street_id_hits"] += 1
+        return entry
+
+    @callback
+    def async_set_street_id(self, key, street_id, error=None):
+        street_ids = self._data["street_ids"]
+        ttl = STREET_ID_TTL if street_id else STREET_ID_MISS_TTL
+        # Reinsert so the dict is ordered by when it was set, the oldest are
+        # evicted first.
+        street_ids.pop(key, None)
+        street_ids[key] = {
+            "street_id": street_id,
+            "error": error,
+            "expires": (datetime.now() + ttl).isoformat(),
+        }
+        while len(street_ids) > MAX_STREET_IDS:
+            street_ids.pop(next(iter(street_ids)))
+        self._async_schedule_save()
+
+    def get_calendar(self, street_id):
+        """Get the cached calendar for a street_id or None.
+
+        The result is a dict with calendar, fetched and the etag, last_modified
+        and digest we need to check if the page has changed.
+        """
+        cached = self._data["calendars"].get(street_id)
+        if not cached:
+            return None
+
+        try:
+            return {
+                "calendar": {
+                    gbt: [datetime.fromisoformat(d) for d in dates]
+                    for gbt, dates in cached["calendar"].items()
+                },
+                "fetched": datetime.fromisoformat(cached["fetched"]),
+                "etag": cached.get("etag"),
+                "last_modified": cached.get("last_modified"),
+                "digest": cached.get("digest"),
+            }
+        except (KeyError, TypeError, ValueError):
+            _LOGGER.debug("Ignoring broken cache for %s", street_id)
+            return None
+
+    @callback
+    def async_set_calendar(
+        self, street_id, calendar, fetched, etag=None, last_modified=None, digest=None
+    ):
+        self._data["calendars"][street_id] = {
+            "calendar": {
+                gbt: [d.isoformat() for d in dates if d is not None]
+                for gbt, dates in calendar.items()
+            },
+            "fetched": fetched.isoformat(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "digest": digest,
+        }
+        self._async_schedule_save()
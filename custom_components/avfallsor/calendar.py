@@ -0,0 +1,71 @@
+"""Calendar with all the pickups we know about, answered from the PickupIndex."""
+
+import logging
+from datetime import time, timedelta
+
+from homeassistant.components.calendar import CalendarEntity, CalendarEvent
+from homeassistant.util import dt as dt_util
+
+from . import DOMAIN
+from .utils import gb_map
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_entry(hass, config_entry, async_add_devices):
+    """Setup calendar platform for the ui"""
+    # async_setup_entry in __init__ has waited for the calendar.
+    data = hass.data[DOMAIN]["entries"][config_entry.entry_id]
+    async_add_devices([AvfallSorCalendar(data)])
+    return True
+
+
+def pickup_event(day, garbage_type):
+    """All day event for a pickup, day is the datetime from the index."""
+    return CalendarEvent(
+        start=day.date(),
+        end=day.date() + timedelta(days=1),
+        summary=gb_map.get(garbage_type, garbage_type),
+        uid=f"{day:%Y%m%d}-{garbage_type}",
+    )
+
+
+class AvfallSorCalendar(CalendarEntity):
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def should_poll(self):
+        return False
+
+    async def async_added_to_hass(self):
+        """Write the state when the shared data gets new data."""
+        self.async_on_remove(self.data.async_add_listener(self.async_write_ha_state))
+
+    @property
+    def event(self):
+        """The next pickup, if there are more than one that day the first type."""
+        upcoming = self.data.upcoming()
+        return pickup_event(*upcoming[0]) if upcoming else None
+
+    async def async_get_events(self, hass, start_date, end_date):
+        """Get the pickups between start_date and end_date, nothing is fetched."""
+        start = dt_util.as_local(start_date)
+        end = dt_util.as_local(end_date)
+        # The events are whole days, include the day end_date is in unless it
+        # ends at midnight.
+        end_day = end.date()
+        if end.time() != time.min:
+            end_day += timedelta(days=1)
+        return [
+            pickup_event(day, gbt)
+            for day, gbt in self.data.index.pickups(start.date(), end_day)
+        ]
+
+    @property
+    def unique_id(self) -> str:
+        return f"avfallsor_calendar_{self.data.street_id.replace('-', '_')}"
+
+    @property
+    def name(self) -> str:
+        return self.unique_id
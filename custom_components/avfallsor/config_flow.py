@@ -2,18 +2,25 @@
 
 import logging
 from collections import OrderedDict
+from datetime import datetime
 
+import aiohttp
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from . import DOMAIN, garbage_types
+from .cache import async_get_cache
+from .coordinator import DEFAULT_SETUP_TIMEOUT
+from .parser import pickup_block_digest
+from .timing import get_lookup_timings
 from .utils import (
     check_settings,
-    check_tomme_kalender,
-    find_id,
-    find_id_from_lat_lon,
-    get_tommeplan_page,
+    fetch_tommeplan_page,
+    find_id_cached,
+    find_id_from_lat_lon_cached,
+    parse_tomme_kalender,
+    valid_tomme_kalender,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -30,11 +37,15 @@ def create_schema(entry, option=False):
         # We use .get here incase some of the texts gets changed.
         default_adress = entry.data.get("address", "")
         default_street_id = entry.data.get("street_id", "")
+        default_upcoming = entry.data.get("upcoming", False)
+        default_setup_timeout = entry.data.get("setup_timeout", DEFAULT_SETUP_TIMEOUT)
         for z in entry.data.get("garbage_types", garbage_types):
             default_garbage_types_enabled.append(z)
     else:
         default_adress = ""
         default_street_id = ""
+        default_upcoming = False
+        default_setup_timeout = DEFAULT_SETUP_TIMEOUT
         default_garbage_types_enabled = garbage_types
 
     data_schema = OrderedDict()
@@ -54,6 +65,11 @@ def create_schema(entry, option=False):
         else:
             data_schema[vol.Optional(gbt, default=True)] = bool
 
+    data_schema[vol.Optional("upcoming", default=default_upcoming)] = bool
+    data_schema[vol.Optional("setup_timeout", default=default_setup_timeout)] = vol.All(
+        vol.Coerce(int), vol.Range(min=0)
+    )
+
     return data_schema
 
 
@@ -76,7 +92,16 @@ class Mixin:
         # We only want to skip this if its blank, this is not required
         # if we got other info we can use.
         if user_input.get("address") is not None and street_id is None:
-            street_id_from_adr = await find_id(user_input.get("address"), client)
+            try:
+                street_id_from_adr = await find_id_cached(
+                    user_input.get("address"),
+                    client,
+                    self.hass,  # type: ignore
+                )
+            except (aiohttp.ClientError, TimeoutError):
+                _LOGGER.exception("Failed to look up %s", user_input.get("address"))
+                self._errors["base"] = "cannot_connect"  # type: ignore
+                return False
             if street_id_from_adr is not None:
                 street_id = street_id_from_adr
             else:
@@ -84,22 +109,52 @@ class Mixin:
 
         if street_id is None:
             try:
-                street_id_from_lat_lon = await find_id_from_lat_lon(
-                    self.hass.config.latitude,
-                    self.hass.config.longitude,
-                    client,  # type: ignore
+                street_id_from_lat_lon = await find_id_from_lat_lon_cached(
+                    self.hass.config.latitude,  # type: ignore
+                    self.hass.config.longitude,  # type: ignore
+                    client,
+                    self.hass,  # type: ignore
                 )
 
                 if street_id_from_lat_lon is not None:
                     street_id = street_id_from_lat_lon
             except ValueError:
                 self._errors["base"] = "wrong_lat_lon"  # type: ignore
+            except (aiohttp.ClientError, TimeoutError):
+                _LOGGER.exception("Failed to look up the street_id from lat lon")
+                self._errors["base"] = "cannot_connect"  # type: ignore
+                return False
 
         if street_id is not None:
             # We need to parse this as the site returns a generic site without
             # any tømmeplan if the id invalid
-            text = await get_tommeplan_page(street_id, client)
-            if check_tomme_kalender(text) is True:
+            timings = get_lookup_timings(self.hass)  # type: ignore
+            try:
+                with timings.stage("flow_fetch"):
+                    page = await fetch_tommeplan_page(street_id, client)
+            except (aiohttp.ClientError, TimeoutError):
+                _LOGGER.exception("Failed to get the tommeplan page for %s", street_id)
+                self._errors["base"] = "cannot_connect"  # type: ignore
+                return False
+            tomme_kalender = {}
+            if page is not None:
+                with timings.stage("flow_parse"):
+                    tomme_kalender = await self.hass.async_add_executor_job(  # type: ignore
+                        parse_tomme_kalender, page.text
+                    )
+            if valid_tomme_kalender(tomme_kalender):
+                # Hand what we found over to the entry so it don't have to
+                # look up the street_id and get the page again.
+                self._street_id = street_id
+                cache = await async_get_cache(self.hass)  # type: ignore
+                cache.async_set_calendar(
+                    street_id,
+                    tomme_kalender,
+                    datetime.now(),
+                    page.etag,
+                    page.last_modified,
+                    pickup_block_digest(page.text),
+                )
                 return True
             else:
                 self._errors["base"] = "invalid_street_id"  # type: ignore
@@ -119,6 +174,7 @@ class AvfallSorFlowHandler(Mixin, config_entries.ConfigFlow, domain=DOMAIN):
     def __init__(self):
         """Initialize."""
         self._errors = {}
+        self._street_id = None
 
     async def async_step_user(self, user_input=None):  # pylint: disable=dangerous-default-value
         """Handle a flow initialized by the user."""
@@ -135,6 +191,7 @@ class AvfallSorFlowHandler(Mixin, config_entries.ConfigFlow, domain=DOMAIN):
 
             adr = await self.test_setup(user_input)
             if adr:
+                user_input["street_id"] = self._street_id
                 return self.async_create_entry(title="avfallsor", data=user_input)
 
         return await self._show_config_form(user_input)
@@ -168,6 +225,7 @@ class AvfallsorOptionsHandler(config_entries.OptionsFlow, Mixin):
         self.config_entry = config_entry
         self.options = dict(config_entry.options)
         self._errors = {}
+        self._street_id = None
 
     async def async_step_init(self, user_input=None):
         return self.async_show_form(
@@ -190,6 +248,7 @@ class AvfallsorOptionsHandler(config_entries.OptionsFlow, Mixin):
 
             ok = await self.test_setup(user_input)
             if ok:
+                user_input["street_id"] = self._street_id
                 self.hass.config_entries.async_update_entry(
                     self.config_entry, data=user_input
                 )
@@ -0,0 +1,743 @@
+"""Shared calendar data, one AvfallSorData per street_id."""
+
+import asyncio
+import logging
+import os
+import random
+from collections import deque
+from datetime import datetime, timedelta
+
+import aiohttp
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_call_later, async_track_time_change
+from homeassistant.util import dt as dt_util
+
+from . import DOMAIN
+from .cache import async_get_cache
+from .history import async_get_history
+from .parser import pickup_block_digest
+from .timing import StageTimings
+from .utils import (
+    AVFALLSOR_HOST,
+    HostCircuitBreaker,
+    HostRateLimiter,
+    PickupIndex,
+    fetch_tommeplan_page,
+    find_id_cached,
+    find_id_from_lat_lon_cached,
+    parse_pickup_index,
+    pickup_calendar,
+    valid_pickup_counts,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# The calendar is refreshed when about half of the known pickups are left,
+# sooner if the page changed recently, but always between these limits.
+MIN_REFRESH_INTERVAL = timedelta(hours=6)
+MAX_REFRESH_INTERVAL = timedelta(weeks=2)
+# How far back a change on the page makes us refresh more often.
+CHANGE_WINDOW = timedelta(days=30)
+# A failed refresh is retried after RETRY_MIN, doubled for every failure in
+# a row up to RETRY_MAX, with jitter so the entries don't retry together.
+RETRY_MIN = timedelta(minutes=1)
+RETRY_MAX = timedelta(hours=6)
+# Shared by all entries, after this many failures in a row we stop asking
+# avfallsor.no for a while.
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_AFTER = timedelta(minutes=5)
+# When the site works again the failed ones are refreshed within this time.
+RECOVERY_SPREAD = timedelta(seconds=30)
+# A cached calendar newer than this is used as is at startup, this is what
+# we get when the config flow just fetched it.
+REVALIDATE_AFTER = timedelta(hours=1)
+
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_RATE_LIMIT = 10
+PROCESS_POOL_WORKERS = 4
+# Seconds the platforms wait for the first calendar before adding the entities.
+DEFAULT_SETUP_TIMEOUT = 10
+
+
+async def find_street_id(config, hass, client, use_lat_lon=True):
+    """Helper to get get the correct info with the least possible setup
+
+    Find the info using different methods where the prios are:
+    1. streetid
+    2. address
+    3. lat and lon set in ha config when this was setup, unless use_lat_lon
+       is False.
+
+    """
+    if config.get("street_id"):
+        return config.get("street_id")
+
+    if config.get("address"):
+        result = await find_id_cached(config.get("address"), client, hass)
+        if result:
+            return result
+
+    lat, lon = hass.config.latitude, hass.config.longitude
+    if use_lat_lon and lat and lon:
+        try:
+            return await find_id_from_lat_lon_cached(lat, lon, client, hass)
+        except ValueError:
+            _LOGGER.warning("Latitude and longitude %s, %s is not in Norway", lat, lon)
+
+    return None
+
+
+async def async_acquire_data(
+    hass, config, use_lat_lon=True, start=True, lookup_timeout=None
+):
+    """Get the shared AvfallSorData for the street_id this config points to.
+
+    Every call must be paired with a call to release_data.
+    Returns None if we could not find the street_id. With start=False a new
+    AvfallSorData is not started, the caller must call async_start. The
+    street_id lookups raise TimeoutError if they take over lookup_timeout.
+    """
+    client = async_get_clientsession(hass)
+    cache = await async_get_cache(hass)
+
+    street_id = await asyncio.wait_for(
+        find_street_id(config, hass, client, use_lat_lon), lookup_timeout
+    )
+    if not street_id:
+        return None
+
+    history = await async_get_history(hass, street_id)
+    shared = hass.data.setdefault(DOMAIN, {}).setdefault("data", {})
+    data = shared.get(street_id)
+    if data is None:
+        _LOGGER.debug("Creating AvfallSorData for %s", street_id)
+        data = shared[street_id] = AvfallSorData(
+            hass, street_id, client, cache, history
+        )
+        data.load_cached()
+        if start:
+            data.async_start()
+
+    data.refs += 1
+    return data
+
+
+def release_data(hass, street_id):
+    """Release a AvfallSorData, it is removed when the last user is gone."""
+    shared = hass.data.get(DOMAIN, {}).get("data", {})
+    data = shared.get(street_id)
+    if data is None:
+        return
+
+    data.refs -= 1
+    if data.refs <= 0:
+        _LOGGER.debug("Removing AvfallSorData for %s", street_id)
+        shared.pop(street_id)
+        data.async_shutdown()
+
+
+async def async_refresh_data(hass, street_id=None):
+    """Fetch the calendar now for street_id, or for every street_id we have."""
+    shared = hass.data.get(DOMAIN, {}).get("data", {})
+    datas = [
+        data for key, data in shared.items() if street_id is None or key == street_id
+    ]
+    await asyncio.gather(*(data.async_refresh() for data in datas))
+
+
+@callback
+def async_get_breaker(hass):
+    """Circuit breaker shared by everything that refreshes calendars."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if "breaker" not in domain_data:
+        domain_data["breaker"] = HostCircuitBreaker(
+            BREAKER_THRESHOLD, BREAKER_RESET_AFTER.total_seconds()
+        )
+    return domain_data["breaker"]
+
+
+@callback
+def async_get_process_pool(hass):
+    """Process pool for the malformed pages in bulk mode, shut down when ha stops."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if "process_pool" not in domain_data:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # spawn as forking the ha process with all its threads is not safe.
+        pool = ProcessPoolExecutor(
+            max_workers=min(PROCESS_POOL_WORKERS, os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        domain_data["process_pool"] = pool
+
+        @callback
+        def shutdown(event):
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, shutdown)
+
+    return domain_data["process_pool"]
+
+
+async def async_acquire_bulk_data(hass, config):
+    """Get a AvfallSorBulkData for all the addresses and street_ids in config."""
+    max_concurrency = config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+    rate_limit = config.get("rate_limit", DEFAULT_RATE_LIMIT)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    limiter = HostRateLimiter(rate_limit)
+
+    async def acquire(item):
+        async with semaphore:
+            if "address" in item:
+                await limiter.acquire(AVFALLSOR_HOST)
+            try:
+                # Started below, when the refreshes can go through the bulk
+                # limits.
+                data = await async_acquire_data(
+                    hass, item, use_lat_lon=False, start=False
+                )
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to find the street_id for %s", item)
+                return None
+            if data is None:
+                _LOGGER.warning("Could not find the street_id for %s", item)
+            return data
+
+    items = [{"street_id": street_id} for street_id in config.get("street_ids", [])]
+    items += [{"address": address} for address in config.get("addresses", [])]
+    datas = {}
+    for data in await asyncio.gather(*(acquire(item) for item in items)):
+        if data is None:
+            continue
+        if data.street_id in datas:
+            # Two addresses with the same street_id, one reference is enough.
+            release_data(hass, data.street_id)
+            continue
+        datas[data.street_id] = data
+
+    executor = async_get_process_pool(hass) if config.get("process_pool") else None
+    bulk = AvfallSorBulkData(hass, list(datas.values()), semaphore, limiter, executor)
+    for data in bulk.datas:
+        data.async_start()
+    return bulk
+
+
+class AvfallSorBulkData:
+    """Many AvfallSorData that are refreshed together.
+
+    The pages are fetched concurrently, limited by a semaphore and a rate limit
+    per host, so refreshing many addresses takes about as long as a few.
+    """
+
+    def __init__(self, hass, datas, semaphore, limiter, executor=None):
+        self._hass = hass
+        self.datas = datas
+        self._semaphore = semaphore
+        self._limiter = limiter
+        self._executor = executor
+        self._last_attempt = None
+        self._refresh_task = None
+        for data in datas:
+            data.bulk = self
+
+    async def update_one(self, data, force=False):
+        async with self._semaphore:
+            try:
+                await data.update(
+                    force=force, limiter=self._limiter, executor=self._executor
+                )
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to update %s", data.street_id)
+
+    async def update(self, force=False):
+        """Refresh all the addresses, or wait for the refresh that is running."""
+        if self._refresh_task is None:
+            now = datetime.now()
+            if (
+                not force
+                and self._last_attempt is not None
+                and now - self._last_attempt < MIN_REFRESH_INTERVAL
+            ):
+                return
+
+            self._last_attempt = now
+            self._refresh_task = self._hass.async_create_task(
+                self._async_update_all(force)
+            )
+        await asyncio.shield(self._refresh_task)
+
+    async def _async_update_all(self, force):
+        start = datetime.now()
+        try:
+            await asyncio.gather(*(self.update_one(data, force) for data in self.datas))
+        finally:
+            self._refresh_task = None
+        _LOGGER.debug(
+            "Updated %s street_ids in %s", len(self.datas), datetime.now() - start
+        )
+
+
+class AvfallSorData:
+    """The calendar for one street_id.
+
+    All entities using the same street_id share one instance, so the page is
+    fetched and parsed once and the result is pushed to every listener.
+
+    Nothing is polled, the next refresh is planned from how much of the
+    calendar is left and how often it has changed lately. The listeners are
+    also called at midnight as that is when the days until a pickup changes.
+    A failed refresh keeps the last good calendar and marks it as stale.
+    """
+
+    def __init__(self, hass, street_id, client, cache=None, history=None):
+        self._hass = hass
+        self._street_id = street_id
+        self.client = client
+        self._cache = cache
+        # The pickups that have passed are added here before they are gone.
+        self.history = history
+        self._breaker = async_get_breaker(hass)
+        self.index = PickupIndex()
+        self._last_update = None
+        self._last_attempt = None
+        # The refresh that is running, callers that come while it runs wait for it.
+        self._refresh_task = None
+        # Set when the first refresh is done, good or not.
+        self._first_refresh = asyncio.Event()
+        # Failed refreshes in a row.
+        self._failures = 0
+        self._listeners = []
+        # Called after every refresh, even if nothing changed.
+        self._refresh_listeners = []
+        self.refs = 0
+        # Bumped every time we get a new calendar, entities use it to know
+        # when what they have worked out is out of date.
+        self.version = 0
+        # What upcoming worked out, for (version, today).
+        self._upcoming_key = None
+        self._upcoming = []
+        self._next_pickups = {}
+        # Set when this is part of a AvfallSorBulkData.
+        self.bulk = None
+        # When the calendar changed, used to plan the next refresh.
+        self._changes = deque(maxlen=10)
+        self._unsub_refresh = None
+        self._unsub_midnight = None
+        # Used to check if the page has changed since the last fetch.
+        self._etag = None
+        self._last_modified = None
+        self._digest = None
+        self.stats = {"requests": 0, "not_modified": 0, "unchanged": 0, "parsed": 0}
+        self.timings = StageTimings()
+        # Bytes we read of the last page, the reading stops after the calendar.
+        self.page_size = None
+
+    @property
+    def street_id(self):
+        return self._street_id
+
+    @property
+    def stale(self):
+        """True if we have no calendar or the last refresh failed."""
+        return self._last_update is None or self._failures > 0
+
+    @property
+    def cache_hit_rate(self):
+        """How many of the refreshes that did not need a parse, in percent."""
+        if not self.stats["requests"]:
+            return None
+        hits = self.stats["not_modified"] + self.stats["unchanged"]
+        return round(hits / self.stats["requests"] * 100, 1)
+
+    def diagnostics(self):
+        return {
+            "street_id": self._street_id,
+            "last_update": self._last_update,
+            "last_attempt": self._last_attempt,
+            "refreshing": self._refresh_task is not None,
+            "stale": self.stale,
+            "failures": self._failures,
+            "version": self.version,
+            "refs": self.refs,
+            "bulk": self.bulk is not None,
+            "pickups": self.index.counts(),
+            "refresh_interval": self.refresh_interval(),
+            "changes": list(self._changes),
+            "page_size": self.page_size,
+            "cache_hit_rate": self.cache_hit_rate,
+            "stats": dict(self.stats),
+            "timings": self.timings.as_dict(),
+            "history": self.history.diagnostics() if self.history else None,
+        }
+
+    @property
+    def age(self):
+        """How old the calendar is, None if we don't have one."""
+        if self._last_update is None:
+            return None
+        return datetime.now() - self._last_update
+
+    def _update_upcoming(self, today):
+        key = (self.version, today)
+        if key == self._upcoming_key:
+            return
+        with self.timings.stage("state"):
+            upcoming = self.index.pickups(today)
+            next_pickups = {}
+            for day, gbt in upcoming:
+                next_pickups.setdefault(gbt, day)
+        self._upcoming_key = key
+        self._upcoming, self._next_pickups = upcoming, next_pickups
+
+    def upcoming(self, today=None):
+        """The pickups from today on as (datetime, garbage_type), sorted by day.
+
+        Worked out once per calendar and day and shared by all the entities,
+        today is the local date from dt_util if not set.
+        """
+        self._update_upcoming(today or dt_util.now().date())
+        return self._upcoming
+
+    def next_pickups(self, today=None):
+        """The next pickup per garbage type from today on, {garbage_type: datetime}."""
+        self._update_upcoming(today or dt_util.now().date())
+        return self._next_pickups
+
+    @callback
+    def async_add_listener(self, update_callback, every_refresh=False):
+        """Listen for new data, returns a function that removes the listener.
+
+        With every_refresh it is called after every refresh instead, like the
+        diagnostic sensors need.
+        """
+        listeners = self._refresh_listeners if every_refresh else self._listeners
+        listeners.append(update_callback)
+
+        @callback
+        def remove_listener():
+            if update_callback in listeners:
+                listeners.remove(update_callback)
+
+        return remove_listener
+
+    def load_cached(self):
+        """Use the cached calendar if there is one, returns True if we did."""
+        cached = self._cache.get_calendar(self._street_id) if self._cache else None
+        if cached is None:
+            return False
+
+        self.index = PickupIndex(cached["calendar"])
+        self.version += 1
+        self._last_update = self._last_attempt = cached["fetched"]
+        self._etag = cached["etag"]
+        self._last_modified = cached["last_modified"]
+        self._digest = cached["digest"]
+        _LOGGER.debug("Using cached calendar from %s", self._last_update)
+        return True
+
+    @callback
+    def async_start(self):
+        """Start the midnight tick and plan the first refresh."""
+        if self._unsub_midnight is not None:
+            # Already started by someone else that shares it.
+            return
+        self._async_record_history()
+        self._unsub_midnight = async_track_time_change(
+            self._hass, self._async_midnight, hour=0, minute=0, second=0
+        )
+        if self.age is None or self.age > REVALIDATE_AFTER:
+            # Serve the cached calendar (if any) right away and check for
+            # changes in the background.
+            self._hass.async_create_task(self.async_refresh())
+        else:
+            self._async_schedule_refresh()
+
+    async def async_wait_ready(self, timeout=DEFAULT_SETUP_TIMEOUT):
+        """Wait up to timeout seconds for the first refresh if we have no calendar.
+
+        Returns True if we have a calendar. If not the listeners are called
+        when it arrives, so the caller can go on without it.
+        """
+        if self._last_update is None and timeout:
+            try:
+                await asyncio.wait_for(self._first_refresh.wait(), timeout)
+            except TimeoutError:
+                _LOGGER.info(
+                    "No calendar for %s after %ss, it is shown when it arrives",
+                    self._street_id,
+                    timeout,
+                )
+        return self._last_update is not None
+
+    @callback
+    def async_shutdown(self):
+        self._listeners.clear()
+        self._refresh_listeners.clear()
+        for unsub in (self._unsub_refresh, self._unsub_midnight):
+            if unsub is not None:
+                unsub()
+        self._unsub_refresh = self._unsub_midnight = None
+
+    def refresh_interval(self):
+        """How long a calendar we just fetched is good for."""
+        last = self.index.last_pickup
+        if last is None:
+            return MIN_REFRESH_INTERVAL
+
+        now = datetime.now()
+        interval = (last - now) / 2
+        recent = sum(1 for changed in self._changes if now - changed < CHANGE_WINDOW)
+        interval /= 1 + recent
+        return min(max(interval, MIN_REFRESH_INTERVAL), MAX_REFRESH_INTERVAL)
+
+    @callback
+    def _async_schedule_refresh(self, delay=None):
+        """Plan the next refresh, after delay or when the calendar needs it."""
+        if self._unsub_refresh is not None:
+            self._unsub_refresh()
+
+        if delay is None:
+            if self._failures:
+                delay = self._retry_delay()
+            elif self._last_update is None:
+                delay = RETRY_MIN
+            else:
+                delay = max(self.refresh_interval() - self.age, timedelta(0))
+
+        _LOGGER.debug("Next refresh of %s in %s", self._street_id, delay)
+        self._unsub_refresh = async_call_later(
+            self._hass, delay, self._async_scheduled_refresh
+        )
+
+    def _retry_delay(self):
+        backoff = min(RETRY_MIN * 2 ** (self._failures - 1), RETRY_MAX)
+        delay = backoff * random.uniform(0.5, 1)
+        # No point in trying before the breaker lets us through.
+        wait = self._breaker.retry_after(AVFALLSOR_HOST)
+        if wait:
+            delay = max(
+                delay, timedelta(seconds=wait) + RECOVERY_SPREAD * random.random()
+            )
+        return delay
+
+    async def _async_scheduled_refresh(self, _now):
+        self._unsub_refresh = None
+        await self.async_refresh()
+
+    async def async_refresh(self):
+        """Fetch the calendar now, the next refresh is planned afterwards."""
+        if self.bulk is not None:
+            # Use the concurrency and rate limits of the bulk config.
+            await self.bulk.update_one(self, force=True)
+            return
+
+        try:
+            await self.update(force=True)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Failed to refresh %s", self._street_id)
+
+    @callback
+    def _async_midnight(self, _now):
+        """The days until the next pickup changes at midnight."""
+        self._async_record_history()
+        self._async_notify_listeners()
+
+    @callback
+    def _async_record_history(self):
+        """Add the days that have passed to the history."""
+        if self.history is not None:
+            self.history.async_merge(self.index)
+
+    @callback
+    def _async_notify_listeners(self):
+        for update_callback in list(self._listeners):
+            update_callback()
+
+    async def _update(self, limiter=None, executor=None):
+        _LOGGER.debug("Fetching stuff for AvfallSorData %s", self._street_id)
+        if not self._breaker.allow(AVFALLSOR_HOST):
+            _LOGGER.debug(
+                "Not fetching %s, %s is failing", self._street_id, AVFALLSOR_HOST
+            )
+            self._async_set_failed()
+            return
+
+        page = None
+        answered = False
+        try:
+            if limiter is not None:
+                await limiter.acquire(AVFALLSOR_HOST)
+            with self.timings.stage("fetch"):
+                page = await fetch_tommeplan_page(
+                    self._street_id,
+                    self.client,
+                    self._etag,
+                    self._last_modified,
+                    stream=True,
+                )
+            answered = True
+        except (aiohttp.ClientError, TimeoutError) as err:
+            _LOGGER.debug("Failed to fetch %s: %s", self._street_id, err)
+        finally:
+            if not answered:
+                # Whatever went wrong, this might be the trial request the
+                # breaker let through and it must hear how it went.
+                self._breaker.record_failure(AVFALLSOR_HOST)
+        if not answered:
+            self._async_set_failed()
+            return
+
+        # The site answered, anything wrong from here on is about this
+        # street_id and must not pause the requests for the other ones.
+        if self._breaker.record_success(AVFALLSOR_HOST):
+            self._async_host_recovered()
+        if page is None:
+            _LOGGER.debug("No page for %s", self._street_id)
+            self._async_set_failed()
+            return
+
+        digest = None
+        if not page.not_modified:
+            with self.timings.stage("digest"):
+                digest = pickup_block_digest(page.text)
+            if digest is None:
+                # They show a page without the calendar for a bad id and
+                # when they have problems, that is not a empty calendar.
+                _LOGGER.debug("No calendar on the page for %s", self._street_id)
+                self._async_set_failed()
+                return
+
+        self.stats["requests"] += 1
+        if page.not_modified:
+            self.stats["not_modified"] += 1
+            self._async_set_unchanged()
+            return
+
+        self.page_size = page.size
+        if digest == self._digest:
+            self._etag, self._last_modified = page.etag, page.last_modified
+            self.stats["unchanged"] += 1
+            self._async_set_unchanged()
+            return
+
+        with self.timings.stage("parse"):
+            if page.items is not None:
+                # Parsed as it arrived, only the dates are left and that is
+                # too little work to send to a executor.
+                index = PickupIndex(pickup_calendar(page.items))
+            elif executor is not None:
+                index = await asyncio.get_running_loop().run_in_executor(
+                    executor, parse_pickup_index, page.text
+                )
+            else:
+                index = await self._hass.async_add_executor_job(
+                    parse_pickup_index, page.text
+                )
+        if not valid_pickup_counts(index.counts()):
+            # Keep the calendar we have and the old validators, so the whole
+            # page is fetched again next time.
+            self._async_set_failed()
+            return
+
+        self._etag, self._last_modified = page.etag, page.last_modified
+        self.stats["parsed"] += 1
+        if self._digest is not None:
+            self._changes.append(datetime.now())
+        # The new page might not have the days that just passed.
+        self._async_record_history()
+        # The index is never changed, so the entities never see a half updated
+        # calendar.
+        self.index = index
+        self.version += 1
+        self._digest = digest
+        self._last_update = datetime.now()
+        self._failures = 0
+        self._async_save()
+        self._async_notify_listeners()
+
+    @callback
+    def _async_set_unchanged(self):
+        """The calendar is the same as before, there is nothing to parse or update."""
+        _LOGGER.debug(
+            "Calendar for %s is unchanged, refresh stats %s",
+            self._street_id,
+            self.stats,
+        )
+        self._last_update = datetime.now()
+        self._async_save()
+        if self._failures:
+            # We are no longer stale.
+            self._failures = 0
+            self._async_notify_listeners()
+
+    @callback
+    def _async_set_failed(self):
+        """The refresh failed, keep the calendar we have and back off."""
+        self._failures += 1
+        _LOGGER.debug(
+            "Refresh of %s failed %s times in a row", self._street_id, self._failures
+        )
+        if self._failures == 1:
+            # We just became stale.
+            self._async_notify_listeners()
+
+    @callback
+    def _async_host_recovered(self):
+        """avfallsor.no works again, don't let the others wait for their backoff."""
+        _LOGGER.info("%s works again", AVFALLSOR_HOST)
+        for data in self._hass.data.get(DOMAIN, {}).get("data", {}).values():
+            if data is not self and data._failures and data._unsub_midnight:
+                data._async_schedule_refresh(RECOVERY_SPREAD * random.random())
+
+    @callback
+    def _async_save(self):
+        if self._cache is not None:
+            self._cache.async_set_calendar(
+                self._street_id,
+                self.index.as_dict(),
+                self._last_update,
+                self._etag,
+                self._last_modified,
+                self._digest,
+            )
+
+    async def update(self, force=False, limiter=None, executor=None):
+        """Fetch the calendar, at most once per MIN_REFRESH_INTERVAL unless forced.
+
+        If a refresh is already running this waits for it instead of starting
+        another one, so every caller gets the same new calendar from one fetch.
+        """
+        if self._refresh_task is None:
+            now = datetime.now()
+            if (
+                not force
+                and self._last_attempt is not None
+                and now - self._last_attempt < MIN_REFRESH_INTERVAL
+            ):
+                return self.index
+
+            self._last_attempt = now
+            self._refresh_task = self._hass.async_create_task(
+                self._async_update_once(limiter, executor)
+            )
+        # A caller that is cancelled must not cancel the refresh for the others.
+        return await asyncio.shield(self._refresh_task)
+
+    async def _async_update_once(self, limiter, executor):
+        try:
+            await self._update(limiter, executor)
+        except Exception:
+            self._async_set_failed()
+            raise
+        finally:
+            self._refresh_task = None
+            self._first_refresh.set()
+            if self._unsub_midnight is not None:
+                # Still running, plan the next one from what we got.
+                self._async_schedule_refresh()
+            for update_callback in list(self._refresh_listeners):
+                update_callback()
+        return self.index
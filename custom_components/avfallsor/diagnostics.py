@@ -0,0 +1,25 @@
+"""Diagnostics for avfallsor, shows how the refreshes are doing."""
+
+from homeassistant.components.diagnostics import async_redact_data
+
+from . import DOMAIN
+from .coordinator import async_get_breaker
+from .fetch import latency_diagnostics
+from .timing import get_lookup_timings
+
+TO_REDACT = {"address"}
+
+
+async def async_get_config_entry_diagnostics(hass, config_entry):
+    domain_data = hass.data.get(DOMAIN, {})
+    data = domain_data.get("entries", {}).get(config_entry.entry_id)
+    cache = domain_data.get("cache")
+    breaker = async_get_breaker(hass)
+    return {
+        "entry": async_redact_data(dict(config_entry.data), TO_REDACT),
+        "data": data.diagnostics() if data is not None else None,
+        "lookup_timings": get_lookup_timings(hass).as_dict(),
+        "cache": dict(cache.stats) if cache is not None else None,
+        "breaker": breaker.diagnostics(),
+        "latency": latency_diagnostics(),
+    }
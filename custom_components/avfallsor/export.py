@@ -0,0 +1,119 @@
+"""The schedule as iCal or json, for clients that want all of it.
+
+GET /api/avfallsor/<street_id>.ics
+GET /api/avfallsor/<street_id>.json
+
+The body is made once per calendar version and has a ETag, so a client
+that sends If-None-Match gets a 304 until the calendar changes.
+"""
+
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from aiohttp import web
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.util import dt as dt_util
+
+from . import DOMAIN
+from .utils import gb_map
+
+_LOGGER = logging.getLogger(__name__)
+
+FORMATS = {"ics": "text/calendar", "json": "application/json"}
+
+
+def _ical_text(value):
+    for char, escaped in (("\\", "\\\\"), (";", "\\;"), (",", "\\,"), ("\n", "\\n")):
+        value = value.replace(char, escaped)
+    return value
+
+
+def schedule_to_ical(street_id, pickups):
+    """pickups is a list of (datetime, garbage_type) like PickupIndex.pickups."""
+    stamp = dt_util.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//avfallsor//sensor.avfallsor//NO",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_ical_text(f'Avfallsør {street_id}')}",
+    ]
+    for day, gbt in pickups:
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{day:%Y%m%d}-{gbt}-{street_id}@avfallsor",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{day:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{_ical_text(gb_map.get(gbt, gbt))}",
+            "TRANSP:TRANSPARENT",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def schedule_to_json(street_id, pickups):
+    return json.dumps(
+        {
+            "street_id": street_id,
+            "pickups": [
+                {
+                    "date": day.date().isoformat(),
+                    "garbage_type": gbt,
+                    "name": gb_map.get(gbt, gbt),
+                }
+                for day, gbt in pickups
+            ],
+        },
+        ensure_ascii=False,
+    )
+
+
+RENDERERS = {"ics": schedule_to_ical, "json": schedule_to_json}
+
+
+class AvfallSorScheduleView(HomeAssistantView):
+    """Serves the schedule of a street_id we have data for, requires auth."""
+
+    url = "/api/avfallsor/{street_id}.{fmt}"
+    name = "api:avfallsor:schedule"
+
+    def __init__(self):
+        # (street_id, fmt) -> (index, etag, body), the index is replaced and
+        # never changed when the calendar changes. The version is not enough,
+        # a street_id that is released and set up again starts over on it.
+        self._rendered = {}
+
+    def _render(self, shared, data, fmt):
+        key = (data.street_id, fmt)
+        rendered = self._rendered.get(key)
+        if rendered is None or rendered[0] is not data.index:
+            # Don't keep the bodies of street_ids we no longer have.
+            for gone in [k for k in self._rendered if k[0] not in shared]:
+                del self._rendered[gone]
+            body = RENDERERS[fmt](data.street_id, data.index.pickups()).encode("utf-8")
+            etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+            rendered = self._rendered[key] = (data.index, etag, body)
+        return rendered[1], rendered[2]
+
+    async def get(self, request, street_id, fmt):
+        if fmt not in FORMATS:
+            return web.Response(status=404)
+
+        hass = request.app["hass"]
+        shared = hass.data.get(DOMAIN, {}).get("data", {})
+        data = shared.get(street_id)
+        if data is None:
+            return web.Response(status=404)
+
+        etag, body = self._render(shared, data, fmt)
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=3600"}
+        if etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+
+        return web.Response(
+            body=body, content_type=FORMATS[fmt], charset="utf-8", headers=headers
+        )
@@ -0,0 +1,179 @@
+"""The http requests to avfallsor.no and geonorge.
+
+Every request has a connect and read timeout, asks for a compressed response
+and stops reading if the body gets bigger than max_size. The client is the
+shared session from Home Assistant, so the connections to each host are
+reused.
+
+The latency of each request is kept in a histogram per host, see
+latency_diagnostics.
+"""
+
+import importlib.util
+import logging
+from bisect import bisect_left
+from collections.abc import Mapping
+from time import perf_counter
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+# aiohttp only decodes brotli if one of these is installed.
+HAS_BROTLI = (
+    importlib.util.find_spec("brotli") is not None
+    or importlib.util.find_spec("brotlicffi") is not None
+)
+ACCEPT_ENCODING = "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
+# The tømmeplan page is about 100 kB and the api responses a lot less.
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10, sock_read=15)
+MAX_RESPONSE_SIZE = 2 * 1024 * 1024
+CHUNK_SIZE = 16 * 1024
+
+# Upper bounds in ms of the latency buckets, the last bucket is everything above.
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class ResponseTooLarge(aiohttp.ClientPayloadError):
+    """The body was bigger than the max_size of the request."""
+
+
+class UnexpectedStatus(aiohttp.ClientError):
+    """The server answered, but not with something we can use."""
+
+
+class Response(NamedTuple):
+    status: int
+    headers: Mapping[str, str]
+    body: bytes
+    charset: str | None = None
+
+    @property
+    def text(self):
+        return self.body.decode(self.charset or "utf-8", errors="replace")
+
+
+class LatencyHistogram:
+    """Count of requests per latency bucket for one host."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.timeouts = 0
+
+    def record(self, ms):
+        self.counts[bisect_left(LATENCY_BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+
+    def percentile(self, pct):
+        """Upper bound of the bucket the pct percentile is in, None if it is the last."""
+        if not self.count:
+            return None
+        wanted = self.count * pct / 100
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total / self.count, 3) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "buckets": {
+                f"le_{bound}": count
+                for bound, count in zip(LATENCY_BUCKETS, self.counts)
+            }
+            | {"inf": self.counts[-1]},
+        }
+
+
+_HISTOGRAMS = {}
+
+
+def latency_histogram(host):
+    """The histogram of host, it is made the first time."""
+    if host not in _HISTOGRAMS:
+        _HISTOGRAMS[host] = LatencyHistogram()
+    return _HISTOGRAMS[host]
+
+
+def latency_diagnostics():
+    return {host: histogram.as_dict() for host, histogram in _HISTOGRAMS.items()}
+
+
+def reset_latency():
+    _HISTOGRAMS.clear()
+
+
+async def fetch(
+    client,
+    url,
+    params=None,
+    headers=None,
+    timeout=DEFAULT_TIMEOUT,
+    max_size=MAX_RESPONSE_SIZE,
+    stream=None,
+):
+    """GET url and read the body, raises ResponseTooLarge if it is over max_size.
+
+    Timeouts raise TimeoutError and connection problems aiohttp.ClientError,
+    like a plain client.get.
+
+    With stream the chunks are given to stream.feed(chunk, charset) as they
+    arrive instead of being kept in body. When feed returns True the rest of
+    the body is not read and the connection is closed.
+    """
+    histogram = latency_histogram(urlsplit(url).hostname)
+    headers = {"Accept-Encoding": ACCEPT_ENCODING, **(headers or {})}
+    start = perf_counter()
+    try:
+        async with client.get(
+            url, params=params, headers=headers, timeout=timeout
+        ) as resp:
+            if resp.content_length is not None and resp.content_length > max_size:
+                raise ResponseTooLarge(f"{url} is {resp.content_length} bytes")
+            body = bytearray()
+            size = 0
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise ResponseTooLarge(f"{url} is over {max_size} bytes")
+                if stream is None:
+                    body += chunk
+                elif stream.feed(chunk, resp.charset):
+                    if resp.connection is not None:
+                        # Still downloading, drop the connection instead of
+                        # waiting for the rest.
+                        resp.close()
+                    else:
+                        # All of it is here and the connection is back in the
+                        # pool, it stays paused until the buffer is read.
+                        while await resp.content.readany():
+                            pass
+                    break
+            result = Response(
+                resp.status, resp.headers.copy(), bytes(body), resp.charset
+            )
+    except TimeoutError:
+        histogram.timeouts += 1
+        raise
+    except aiohttp.ClientError:
+        histogram.errors += 1
+        raise
+
+    ms = (perf_counter() - start) * 1000
+    histogram.record(ms)
+    _LOGGER.debug("GET %s %s in %.1f ms", url, result.status, ms)
+    return result
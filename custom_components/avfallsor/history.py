@@ -0,0 +1,211 @@
+"""The pickups that have happened, kept per street_id across restarts.
+
+avfallsor.no only shows the coming pickups, so every day that has passed is
+appended here from the calendar we have. A day is never changed once it is
+written, the history only grows at the end and the oldest segments are
+dropped when they are older than MAX_HISTORY_DAYS.
+
+The days are epoch days (days since 1970-01-01) in a sorted array per
+garbage type, so a range or the last pickup of a type is a bisect. On disk
+each segment stores its days as the first day and then the gaps.
+"""
+
+import logging
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from . import DOMAIN
+from .utils import epoch_day, from_epoch_day
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+SAVE_DELAY = 30
+
+# A new segment is started when the open one spans this many days.
+SEGMENT_DAYS = 366
+# Segments that ended longer ago than this are dropped.
+MAX_HISTORY_DAYS = 5 * 366
+
+
+def _encode(days):
+    """[20150, 20157, 20164] -> [20150, 7, 7]"""
+    return [day - prev for prev, day in zip([0, *days], days)]
+
+
+async def async_get_history(hass, street_id):
+    """Get the history of a street_id, it is loaded from disk the first time."""
+    histories = hass.data.setdefault(DOMAIN, {}).setdefault("history", {})
+    history = histories.get(street_id)
+    if history is None:
+        history = histories[street_id] = PickupHistory(hass, street_id)
+        history.loaded = hass.async_create_task(history.async_load())
+
+    await history.loaded
+    return history
+
+
+class PickupHistory:
+    """Append only history of the pickups for one street_id."""
+
+    def __init__(self, hass, street_id):
+        self.street_id = street_id
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.history.{street_id}")
+        # Oldest first, {"first": day, "last": day, "days": {gbt: [day, ...]}}
+        # and only the last one is appended to.
+        self._segments = []
+        # Every day we have per garbage type, this is what the queries use.
+        self._days = {}
+        # The last day that has been merged, nothing before it is added again.
+        self.watermark = None
+        self.loaded = None
+
+    async def async_load(self):
+        data = await self._store.async_load()
+        if not data:
+            return
+
+        try:
+            segments = [
+                {
+                    "first": segment["first"],
+                    "last": segment["last"],
+                    "days": {
+                        gbt: list(accumulate(gaps))
+                        for gbt, gaps in segment["days"].items()
+                    },
+                }
+                for segment in data["segments"]
+            ]
+            watermark = data["watermark"]
+        except (KeyError, TypeError, AttributeError):
+            _LOGGER.warning("Ignoring broken history for %s", self.street_id)
+            return
+
+        self._segments = segments
+        self.watermark = watermark
+        self._rebuild()
+
+    def _rebuild(self):
+        days = {}
+        for segment in self._segments:
+            for gbt, seg_days in segment["days"].items():
+                days.setdefault(gbt, array("i")).extend(seg_days)
+        self._days = days
+
+    def _data_to_save(self):
+        return {
+            "watermark": self.watermark,
+            "segments": [
+                {
+                    "first": segment["first"],
+                    "last": segment["last"],
+                    "days": {
+                        gbt: _encode(days) for gbt, days in segment["days"].items()
+                    },
+                }
+                for segment in self._segments
+            ],
+        }
+
+    @callback
+    def async_merge(self, index, today=None):
+        """Append the pickups in index after the watermark and before today.
+
+        Returns how many pickups were added. This runs every midnight, so
+        it is also where the old segments are dropped.
+        """
+        today = epoch_day(today or dt_util.now())
+        if not index or (self.watermark is not None and self.watermark >= today - 1):
+            return 0
+
+        start = None
+        if self.watermark is not None:
+            start = from_epoch_day(self.watermark + 1)
+        # Sorted by day, so the arrays stay sorted.
+        pickups = index.pickups(start, from_epoch_day(today))
+        self.watermark = today - 1
+
+        for pickup, gbt in pickups:
+            day = epoch_day(pickup)
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or day - segment["first"] >= SEGMENT_DAYS:
+                segment = {"first": day, "last": day, "days": {}}
+                self._segments.append(segment)
+            segment["last"] = day
+            segment["days"].setdefault(gbt, []).append(day)
+            self._days.setdefault(gbt, array("i")).append(day)
+
+        if pickups:
+            _LOGGER.debug(
+                "Added %s pickups to the history of %s", len(pickups), self.street_id
+            )
+        self._compact(today)
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+        return len(pickups)
+
+    def _compact(self, today):
+        """Drop the segments that ended more than MAX_HISTORY_DAYS ago."""
+        keep = [
+            segment
+            for segment in self._segments
+            if today - segment["last"] <= MAX_HISTORY_DAYS
+        ]
+        if len(keep) == len(self._segments):
+            return 0
+
+        dropped = len(self._segments) - len(keep)
+        self._segments = keep
+        self._rebuild()
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+        return dropped
+
+    def pickups(self, start=None, end=None, garbage_type=None):
+        """The pickups as (date, garbage_type) sorted by day, [start, end) if set."""
+        start = epoch_day(start) if start is not None else None
+        end = epoch_day(end) if end is not None else None
+        result = []
+        for gbt, days in self._days.items():
+            if garbage_type is not None and gbt != garbage_type:
+                continue
+            first = bisect_left(days, start) if start is not None else 0
+            last = bisect_left(days, end) if end is not None else len(days)
+            result.extend((day, gbt) for day in days[first:last])
+        result.sort()
+        return [(from_epoch_day(day), gbt) for day, gbt in result]
+
+    def last_pickup(self, garbage_type, before=None):
+        """The last pickup of garbage_type before the day before, or None."""
+        days = self._days.get(garbage_type, ())
+        i = bisect_left(days, epoch_day(before)) if before is not None else len(days)
+        return from_epoch_day(days[i - 1]) if i else None
+
+    def as_dict(self, start=None, end=None, garbage_type=None):
+        """What the history service returns."""
+        pickups = self.pickups(start, end, garbage_type)
+        types = [garbage_type] if garbage_type is not None else list(self._days)
+        return {
+            "pickups": [
+                {"date": day.isoformat(), "garbage_type": gbt} for day, gbt in pickups
+            ],
+            "last": {
+                gbt: last.isoformat()
+                for gbt in types
+                if (last := self.last_pickup(gbt, end)) is not None
+            },
+            "watermark": None
+            if self.watermark is None
+            else from_epoch_day(self.watermark).isoformat(),
+        }
+
+    def diagnostics(self):
+        return {
+            "watermark": self.watermark,
+            "segments": len(self._segments),
+            "pickups": {gbt: len(days) for gbt, days in self._days.items()},
+        }
@@ -0,0 +1,375 @@
+"""Parser backends used to read the pickup days from the tømmeplan page.
+
+All backends return the same list of ``(tag, value)`` items in document order,
+where tag is ``"h3"`` (value is the heading text) or ``"div"`` (value is a list
+of the waste types found in that div). The items are turned into the final
+calendar by ``utils.parse_tomme_kalender``.
+"""
+
+import codecs
+import hashlib
+import importlib.util
+import logging
+import re
+from html.parser import HTMLParser
+
+_LOGGER = logging.getLogger(__name__)
+
+CALENDAR_CLASS = "pickup-days-large"
+ICON_CLASS = "waste-icon"
+
+BACKEND_FAST = "fast"
+BACKEND_LXML = "lxml"
+BACKEND_HTML5LIB = "html5lib"
+BACKENDS = (BACKEND_FAST, BACKEND_LXML, BACKEND_HTML5LIB)
+
+HAS_LXML = importlib.util.find_spec("lxml") is not None
+
+CALENDAR_START = re.compile(
+    rf"""<div\b[^>]*\bclass\s*=\s*["'][^"']*\b{CALENDAR_CLASS}\b[^"']*["'][^>]*>""",
+    re.IGNORECASE,
+)
+DIV_TAG = re.compile(r"<(/?)div\b[^>]*>", re.IGNORECASE)
+
+# Elements that never have a end tag, we must not put these on the stack.
+VOID_ELEMENTS = frozenset(
+    [
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "source",
+        "track",
+        "wbr",
+    ]
+)
+
+# Start tags that close a open p, the tree is then not what the tags say.
+CLOSES_P = frozenset(
+    [
+        "address",
+        "article",
+        "aside",
+        "blockquote",
+        "details",
+        "dialog",
+        "div",
+        "dl",
+        "fieldset",
+        "figcaption",
+        "figure",
+        "footer",
+        "form",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "header",
+        "hgroup",
+        "hr",
+        "main",
+        "menu",
+        "nav",
+        "ol",
+        "p",
+        "pre",
+        "section",
+        "table",
+        "ul",
+    ]
+)
+HEADINGS = frozenset(["h1", "h2", "h3", "h4", "h5", "h6"])
+# Inside these a self-closing tag is really closed, like <path/> in a svg.
+FOREIGN_ELEMENTS = frozenset(["math", "svg"])
+
+
+def _waste_types(classes):
+    """Get the waste types from a list of css classes, waste-icon--bio -> bio"""
+    return [c.split("--")[1] for c in classes if c != ICON_CLASS and "--" in c]
+
+
+class PickupDaysParser(HTMLParser):
+    """Tokenizer that only looks at the div.pickup-days-large block.
+
+    Everything outside the block is skipped, and the parser sets ``done`` as
+    soon as the block is closed. If the markup inside the block is not well
+    formed ``malformed`` is set, the caller should then use a real tree builder
+    as the result might differ from what a browser would see. That includes
+    end tags a browser would add, like a div inside a p.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.items = []
+        self.done = False
+        self.malformed = False
+        self.found = False
+        # html.parser raised, nothing more is fed to it.
+        self._broken = False
+        # Open tags inside the calendar block, the first one is the direct child.
+        self._stack = None
+        self._heading = None
+        self._classes = None
+        self._text = []
+
+    def _flush_text(self):
+        if self._text:
+            text = "".join(self._text).strip()
+            self._text = []
+            if text and self._heading is not None:
+                self._heading.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        classes = None
+        for key, value in attrs:
+            if key == "class" and value:
+                classes = value.split()
+
+        if self._stack is None:
+            if tag == "div" and classes and CALENDAR_CLASS in classes:
+                self.found = True
+                self._stack = []
+            return
+
+        self._flush_text()
+        if (tag in CLOSES_P and "p" in self._stack) or (
+            tag in HEADINGS and self._stack and self._stack[-1] in HEADINGS
+        ):
+            # Implicitly closed, let a real tree builder decide.
+            self.malformed = True
+        if not self._stack:
+            if tag == "h3":
+                self._heading = []
+            elif tag == "div":
+                self._classes = []
+        elif self._classes is not None and classes and ICON_CLASS in classes:
+            self._classes.extend(_waste_types(classes))
+
+        if tag not in VOID_ELEMENTS:
+            self._stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.done:
+            return
+        foreign = tag in FOREIGN_ELEMENTS or bool(
+            self._stack and FOREIGN_ELEMENTS.intersection(self._stack)
+        )
+        super().handle_startendtag(tag, attrs)
+        if self._stack is not None and tag not in VOID_ELEMENTS and not foreign:
+            # A browser ignores the / in <div/> and the div is left open.
+            self.malformed = True
+
+    def handle_endtag(self, tag):
+        if self.done or self._stack is None or tag in VOID_ELEMENTS:
+            return
+
+        self._flush_text()
+        if not self._stack:
+            if tag == "div":
+                self.done = True
+            else:
+                self.malformed = True
+            return
+
+        if self._stack[-1] != tag:
+            # Implicitly closed or stray tags, let a real tree builder decide.
+            self.malformed = True
+            return
+
+        self._stack.pop()
+        if not self._stack:
+            if self._heading is not None:
+                self.items.append(("h3", "".join(self._heading)))
+                self._heading = None
+            elif self._classes is not None:
+                self.items.append(("div", self._classes))
+                self._classes = None
+
+    def feed(self, data):
+        """Like HTMLParser.feed, but markup it can't read sets malformed."""
+        if self._broken:
+            return
+        try:
+            super().feed(data)
+        except Exception:  # pylint: disable=broad-except
+            # Like <![foo[, html.parser raises AssertionError for that.
+            _LOGGER.debug("html.parser failed on the pickup days", exc_info=True)
+            self._broken = self.malformed = True
+
+    def close(self):
+        if self._broken:
+            return
+        try:
+            super().close()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.debug("html.parser failed on the pickup days", exc_info=True)
+            self._broken = self.malformed = True
+
+    def handle_data(self, data):
+        if self._heading is not None:
+            self._text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+
+
+class PickupDaysStream:
+    """Feed the tømmeplan page as it arrives, only the calendar block is parsed.
+
+    The text before the block is only searched for the start of it and not
+    kept, and feed returns True when the block is closed so the rest of the
+    page don't have to be read. If the block is malformed we read to the end,
+    so the caller can use parse_pickup_days on text.
+    """
+
+    def __init__(self):
+        self._parser = PickupDaysParser()
+        self._decoder = None
+        self._chunks = []
+        # Text we have not found the start of the block in yet.
+        self._head = ""
+        self._started = False
+        # Bytes we have got.
+        self.size = 0
+
+    def feed(self, chunk, charset=None):
+        """Add a chunk of the body, returns True when we have the whole block."""
+        if self._decoder is None:
+            self._decoder = codecs.getincrementaldecoder(charset or "utf-8")(
+                errors="replace"
+            )
+        self.size += len(chunk)
+        return self._feed_text(self._decoder.decode(chunk))
+
+    def _feed_text(self, text):
+        if not self._started:
+            self._head += text
+            start = CALENDAR_START.search(self._head)
+            if start is None:
+                # The start tag might be split over two chunks, keep the last tag.
+                cut = self._head.rfind("<")
+                self._head = self._head[cut:] if cut != -1 else ""
+                return False
+            self._started = True
+            text = self._head[start.start() :]
+            self._head = ""
+
+        self._chunks.append(text)
+        parser = self._parser
+        parser.feed(text)
+        return parser.done and not parser.malformed
+
+    def close(self):
+        """The body is done, call this before using items."""
+        if self._decoder is not None:
+            tail = self._decoder.decode(b"", final=True)
+            if tail:
+                self._feed_text(tail)
+        if self._started:
+            self._parser.close()
+
+    @property
+    def text(self):
+        """The page from the start of the calendar to where we stopped reading.
+
+        Empty if the page has no calendar, pickup_block_digest and the tree
+        builders give the same result for this as for the whole page.
+        """
+        return "".join(self._chunks)
+
+    @property
+    def items(self):
+        """The items like parse_pickup_days, None if the block was not clean."""
+        parser = self._parser
+        if not parser.found or (parser.done and not parser.malformed):
+            return parser.items
+        return None
+
+
+def extract_pickup_block(text):
+    """Get the raw html of the div.pickup-days-large block or None.
+
+    This only counts div tags, it is a lot cheaper than parsing the page and
+    good enough to tell if the calendar has changed.
+    """
+    start = CALENDAR_START.search(text)
+    if start is None:
+        return None
+
+    depth = 1
+    for tag in DIV_TAG.finditer(text, start.end()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return text[start.start() : tag.end()]
+
+    return text[start.start() :]
+
+
+def pickup_block_digest(text):
+    """Digest of the pickup days block, None if the page has no calendar."""
+    block = extract_pickup_block(text)
+    if block is None:
+        return None
+    return hashlib.sha1(block.encode("utf-8")).hexdigest()
+
+
+def _parse_fast(text):
+    parser = PickupDaysParser()
+    parser.feed(text)
+    parser.close()
+    return parser
+
+
+def _parse_soup(text, features):
+    # bs4 and the tree builders are slow to import and only needed when the
+    # fast parser gives up, so they are not imported until we get here.
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, features)
+    calendar_div = soup.select_one(f"div.{CALENDAR_CLASS}")
+    items = []
+    if calendar_div is None:
+        return items
+
+    for item in calendar_div:
+        if item.name == "h3":
+            items.append(("h3", item.get_text(strip=True)))
+        elif item.name == "div":
+            classes = []
+            for span in item.find_all(class_=ICON_CLASS):
+                classes.extend(_waste_types(span["class"]))
+            items.append(("div", classes))
+
+    return items
+
+
+def parse_pickup_days(text, backend=None):
+    """Get the h3 dates and waste classes from the tømmeplan page.
+
+    The default is to use the fast stdlib tokenizer and fall back to
+    html5lib if the tokenizer finds something it does not understand.
+    html5lib builds the tree like a browser does, lxml don't always.
+    """
+    if backend is None or backend == BACKEND_FAST:
+        parser = _parse_fast(text)
+        clean = not parser.found or (parser.done and not parser.malformed)
+        if clean or backend == BACKEND_FAST:
+            return parser.items
+        _LOGGER.debug("Pickup days block is malformed, using a tree builder")
+        backend = BACKEND_HTML5LIB
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown parser backend {backend}")
+
+    return _parse_soup(text, backend)
@@ -1,59 +1,84 @@
+import asyncio
 import logging
-from datetime import datetime, timedelta
 
+import aiohttp
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.components.sensor import PLATFORM_SCHEMA
 from homeassistant.const import ATTR_ATTRIBUTION
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
-from homeassistant.helpers.entity import Entity
-from homeassistant.util import Throttle
+from homeassistant.exceptions import PlatformNotReady
+from homeassistant.helpers.entity import Entity, EntityCategory
+from homeassistant.util import dt as dt_util
 
 from . import DOMAIN, garbage_types
-from .utils import (
-    check_settings,
-    find_id,
-    find_id_from_lat_lon,
-    find_next_garbage_pickup,
-    get_tommeplan_page,
-    parse_tomme_kalender,
+from .coordinator import (
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_RATE_LIMIT,
+    DEFAULT_SETUP_TIMEOUT,
+    async_acquire_bulk_data,
+    async_acquire_data,
 )
+from .utils import check_settings
 
 _LOGGER = logging.getLogger(__name__)
 
+DEFAULT_UPCOMING_COUNT = 6
+
+# Optional sensors that show how the refreshes are doing, key: (unit, value).
+DIAGNOSTIC_SENSORS = {
+    "last_fetch": ("ms", lambda data: data.timings.last.get("fetch")),
+    "last_parse": ("ms", lambda data: data.timings.last.get("parse")),
+    "page_size": ("B", lambda data: data.page_size),
+    "cache_hit_rate": ("%", lambda data: data.cache_hit_rate),
+}
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Optional("address", default=""): cv.string,
         vol.Optional("street_id", default=""): cv.string,
         vol.Optional("garbage_types", default=garbage_types): list,
+        # Bulk mode, many addresses in one platform.
+        vol.Optional("addresses", default=[]): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional("street_ids", default=[]): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional("max_concurrency", default=DEFAULT_MAX_CONCURRENCY): vol.All(
+            vol.Coerce(int), vol.Range(min=1)
+        ),
+        vol.Optional("rate_limit", default=DEFAULT_RATE_LIMIT): vol.All(
+            vol.Coerce(float), vol.Range(min=0.1)
+        ),
+        # Parse the pages in a process pool instead of the thread pool. Only
+        # pages the streaming parser gives up on (malformed markup) are parsed
+        # there, the rest are done as they arrive.
+        vol.Optional("process_pool", default=False): cv.boolean,
+        # One sensor with the upcoming pickups of all types, set garbage_types
+        # to [] to only get this one.
+        vol.Optional("upcoming", default=False): cv.boolean,
+        vol.Optional("upcoming_count", default=DEFAULT_UPCOMING_COUNT): vol.All(
+            vol.Coerce(int), vol.Range(min=1)
+        ),
+        # Seconds to wait for the first calendar, 0 to add the sensors right away.
+        vol.Optional("setup_timeout", default=DEFAULT_SETUP_TIMEOUT): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
     }
 )
 
 
-MIN_TIME_BETWEEN_UPDATES = timedelta(weeks=2)
-
-
-async def dry_setup(hass, config_entry, async_add_devices):
-    config = config_entry
-    street_id = config.get("street_id")
-    address = config.get("address")
-
-    check_settings(config, hass)
-    data = AvfallSorData(
-        address,
-        street_id,
-        hass.config.latitude,
-        hass.config.longitude,
-        async_get_clientsession(hass),
-    )
-
-    # await data.update()
+async def dry_setup(hass, config, data, async_add_devices, bulk=None):
     sensors = []
-    for gb_type in config.get("garbage_types"):
-        sensor = AvfallSor(data, gb_type)
+    # Missing if all the types was unselected in the ui.
+    for gb_type in config.get("garbage_types", []):
+        sensor = AvfallSor(data, gb_type, bulk)
         sensors.append(sensor)
 
+    if config.get("upcoming"):
+        count = config.get("upcoming_count", DEFAULT_UPCOMING_COUNT)
+        sensors.append(AvfallSorUpcoming(data, count, bulk))
+
+    if bulk is None:
+        # Not in bulk mode, thousands of disabled entities is no help.
+        sensors.extend(AvfallSorDiagnostic(data, key) for key in DIAGNOSTIC_SENSORS)
+
     async_add_devices(sensors)
 
 
@@ -61,14 +86,39 @@ async def async_setup_platform(
     hass, config_entry, async_add_devices, discovery_info=None
 ):
     """Setup sensor platform for the ui"""
-    await dry_setup(hass, config_entry, async_add_devices)
+    if config_entry.get("addresses") or config_entry.get("street_ids"):
+        bulk = await async_acquire_bulk_data(hass, config_entry)
+        timeout = config_entry.get("setup_timeout", DEFAULT_SETUP_TIMEOUT)
+        await asyncio.gather(*(data.async_wait_ready(timeout) for data in bulk.datas))
+        for data in bulk.datas:
+            await dry_setup(hass, config_entry, data, async_add_devices, bulk)
+        return True
+
+    check_settings(config_entry, hass)
+    # The lookups and the wait for the calendar share setup_timeout, like a
+    # config entry.
+    timeout = config_entry.get("setup_timeout", DEFAULT_SETUP_TIMEOUT)
+    deadline = hass.loop.time() + timeout
+    try:
+        data = await async_acquire_data(
+            hass, config_entry, lookup_timeout=timeout or DEFAULT_SETUP_TIMEOUT
+        )
+    except (aiohttp.ClientError, TimeoutError) as err:
+        raise PlatformNotReady(f"Could not look up the street_id: {err}") from err
+    if data is None:
+        raise PlatformNotReady("Could not find the street_id")
+
+    await data.async_wait_ready(max(deadline - hass.loop.time(), 0))
+    await dry_setup(hass, config_entry, data, async_add_devices)
     return True
 
 
 async def async_setup_entry(hass, config_entry, async_add_devices):
     """Setup sensor platform for the ui"""
+    # async_setup_entry in __init__ has waited for the calendar.
     config = config_entry.data
-    await dry_setup(hass, config, async_add_devices)
+    data = hass.data[DOMAIN]["entries"][config_entry.entry_id]
+    await dry_setup(hass, config, data, async_add_devices)
     return True
 
 
@@ -81,95 +131,60 @@ async def async_remove_entry(hass, config_entry):
         pass
 
 
-class AvfallSorData:
-    def __init__(self, address, street_id, lat, lon, client):
-        self._address = address
-        self._street_id = street_id
-        self.client = client
-        self._data = {}
-        self._last_update = None
-        self._lat = lat
-        self._lon = lon
-        self._friendly_name = None
-
-    async def find_street_id(self):
-        """Helper to get get the correct info with the least possible setup
-
-        Find the info using different methods where the prios are:
-        1. streetid
-        2. address
-        3. lat and lon set in ha config when this was setup.
-
-        """
-        # use
-        # verify_that_we_can_find_id
-        if not len(self._street_id):
-            if self._address:
-                result = await find_id(self._address, self.client)
-                if result:
-                    self._street_id = result
-                    return
-            if self._lat and self._lon and self._street_id is None:
-                result = await find_id_from_lat_lon(self._lat, self._lon, self.client)
-                if result:
-                    self._street_id = result
-                    return
-
-    @Throttle(MIN_TIME_BETWEEN_UPDATES)
-    async def _update(self):
-        _LOGGER.debug("Fetching stuff for AvfallSorData")
-        await self.find_street_id()
-        if self._street_id:
-            text = await get_tommeplan_page(self._street_id, self.client)
-        else:
-            return
-
-        if text:
-            self._data = parse_tomme_kalender(text)
-            self._last_update = datetime.now()
-
-    async def update(self):
-        await self._update()
-        return self._data
-
-
 class AvfallSor(Entity):
-    def __init__(self, data, garbage_type):
+    def __init__(self, data, garbage_type, bulk=None):
         self.data = data
         self._garbage_type = garbage_type
+        # In bulk mode all the addresses are updated together.
+        self._bulk = bulk
+        self._rendered_key = None
+        self._rendered = None
+
+    def _render(self):
+        """State and attributes, only made again when the data or the day changes."""
+        data = self.data
+        today = dt_util.now().date()
+        key = (data.version, today, data.stale, data._last_update)
+        if key != self._rendered_key:
+            nxt = data.next_pickups(today).get(self._garbage_type)
+            state = (nxt.date() - today).days if nxt is not None else None
+            attributes = {
+                "next garbage pickup": nxt,
+                ATTR_ATTRIBUTION: "avfallsør",
+                "last update": data._last_update,
+                # stale means the last refresh failed and we use the last good data.
+                "data": "stale" if data.stale else "fresh",
+                "garbage_type": self._garbage_type,
+            }
+            self._rendered_key, self._rendered = key, (state, attributes)
+        return self._rendered
+
+    @property
+    def should_poll(self):
+        """The shared data pushes new state, so there is nothing to poll."""
+        return False
 
     @property
     def state(self):
         """Return the state of the sensor."""
-        nxt = self.next_garbage_pickup
-        if nxt is not None:
-            delta = nxt.date() - datetime.today().date()
-            return delta.days
+        return self._render()[0]
+
+    async def async_added_to_hass(self):
+        """Write the state when the shared data gets new data."""
+        self.async_on_remove(self.data.async_add_listener(self.async_write_ha_state))
 
     async def async_update(self):
-        await self.data.update()
+        """Only used by homeassistant.update_entity, there is no polling."""
+        if self._bulk is not None:
+            await self._bulk.update()
+        else:
+            await self.data.update()
 
     @property
     def next_garbage_pickup(self):
         """Get the date of the next picked for that garbage type."""
         # 'metal', 'paper', 'glass', 'residual', 'bio', 'plastic'
-        if self._garbage_type == "paper":
-            return find_next_garbage_pickup(self.data._data.get("paper"))
-
-        elif self._garbage_type == "bio":
-            return find_next_garbage_pickup(self.data._data.get("bio"))
-
-        elif self._garbage_type == "residual":
-            return find_next_garbage_pickup(self.data._data.get("residual"))
-
-        elif self._garbage_type == "metal":
-            return find_next_garbage_pickup(self.data._data.get("metal"))
-
-        elif self._garbage_type == "plastic":
-            return find_next_garbage_pickup(self.data._data.get("plastic"))
-
-        elif self._garbage_type == "glass":
-            return find_next_garbage_pickup(self.data._data.get("glass"))
+        return self.data.next_pickups().get(self._garbage_type)
 
     @property
     def icon(self) -> str:
@@ -198,9 +213,7 @@ class AvfallSor(Entity):
     @property
     def unique_id(self) -> str:
         """Return the name of the sensor."""
-        return (
-            f"avfallsor_{self._garbage_type}_{self.data._street_id.replace('-', '_')}"
-        )
+        return f"avfallsor_{self._garbage_type}_{self.data.street_id.replace('-', '_')}"
 
     @property
     def name(self) -> str:
@@ -209,12 +222,7 @@ class AvfallSor(Entity):
     @property
     def extra_state_attributes(self) -> dict:
         """Return the state attributes."""
-        return {
-            "next garbage pickup": self.next_garbage_pickup,
-            ATTR_ATTRIBUTION: "avfallsør",
-            "last update": self.data._last_update,
-            "garbage_type": self._garbage_type,
-        }
+        return self._render()[1]
 
     @property
     def device_info(self) -> dict:
@@ -238,3 +246,127 @@ class AvfallSor(Entity):
     @property
     def friendly_name(self) -> str:
         return self._friendly_name  # type: ignore
+
+
+class AvfallSorUpcoming(Entity):
+    """The upcoming pickups of all types for a address in one sensor.
+
+    The state is the days until the next pickup of any type, the attributes
+    have the next pickup per type and the next count pickups.
+    """
+
+    def __init__(self, data, count, bulk=None):
+        self.data = data
+        self._count = count
+        self._bulk = bulk
+        self._rendered_key = None
+        self._rendered = None
+
+    def _render(self):
+        """State and attributes, only made again when the data or the day changes."""
+        data = self.data
+        today = dt_util.now().date()
+        key = (data.version, today, data.stale, data._last_update)
+        if key != self._rendered_key:
+            upcoming = data.upcoming(today)
+            state = (upcoming[0][0].date() - today).days if upcoming else None
+            attributes = {
+                "next pickup": {
+                    gbt: day.date() for gbt, day in data.next_pickups(today).items()
+                },
+                "upcoming": [
+                    {"date": day.date(), "garbage_type": gbt}
+                    for day, gbt in upcoming[: self._count]
+                ],
+                ATTR_ATTRIBUTION: "avfallsør",
+                "last update": data._last_update,
+                "data": "stale" if data.stale else "fresh",
+            }
+            self._rendered_key, self._rendered = key, (state, attributes)
+        return self._rendered
+
+    @property
+    def should_poll(self):
+        return False
+
+    @property
+    def state(self):
+        return self._render()[0]
+
+    async def async_added_to_hass(self):
+        """Write the state when the shared data gets new data."""
+        self.async_on_remove(self.data.async_add_listener(self.async_write_ha_state))
+
+    async def async_update(self):
+        """Only used by homeassistant.update_entity, there is no polling."""
+        if self._bulk is not None:
+            await self._bulk.update()
+        else:
+            await self.data.update()
+
+    @property
+    def icon(self) -> str:
+        return "mdi:trash-can"
+
+    @property
+    def unique_id(self) -> str:
+        return f"avfallsor_upcoming_{self.data.street_id.replace('-', '_')}"
+
+    @property
+    def name(self) -> str:
+        return self.unique_id
+
+    @property
+    def extra_state_attributes(self) -> dict:
+        return self._render()[1]
+
+    @property
+    def unit_of_measurement(self) -> str:
+        return "days"
+
+
+class AvfallSorDiagnostic(Entity):
+    """Shows how the refreshes for a street_id are doing, disabled by default."""
+
+    def __init__(self, data, key):
+        self.data = data
+        self._key = key
+        self._unit, self._value = DIAGNOSTIC_SENSORS[key]
+
+    @property
+    def should_poll(self):
+        return False
+
+    @property
+    def entity_category(self):
+        return EntityCategory.DIAGNOSTIC
+
+    @property
+    def entity_registry_enabled_default(self):
+        return False
+
+    async def async_added_to_hass(self):
+        # Someone is looking, so start timing the refreshes.
+        self.data.timings.enabled = True
+        self.async_on_remove(
+            self.data.async_add_listener(self.async_write_ha_state, every_refresh=True)
+        )
+
+    @property
+    def state(self):
+        value = self._value(self.data)
+        if isinstance(value, float):
+            return round(value, 1)
+        return value
+
+    @property
+    def unique_id(self) -> str:
+        return f"avfallsor_{self._key}_{self.data.street_id.replace('-', '_')}"
+
+    @property
+    def name(self) -> str:
+        return self.unique_id
+
+    @property
+    def unit_of_measurement(self) -> str:
+        return self._unit
@@ -0,0 +1,84 @@
+"""Cheap timing of the refresh stages, shown in diagnostics and diagnostic sensors.
+
+Nothing is measured unless the timings are enabled (a diagnostic sensor is
+in use) or debug logging is on for the integration, so the hooks can be
+left in the hot paths.
+"""
+
+import logging
+from time import perf_counter
+
+from . import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _NoopStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopStage()
+
+
+class _Stage:
+    __slots__ = ("_name", "_start", "_timings")
+
+    def __init__(self, timings, name):
+        self._timings = timings
+        self._name = name
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._timings.record(self._name, (perf_counter() - self._start) * 1000)
+        return False
+
+
+class StageTimings:
+    """The last and average duration in ms of each stage.
+
+    with timings.stage("parse"):
+        ...
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.last = {}
+        self._total = {}
+        self._count = {}
+
+    def stage(self, name):
+        if self.enabled or _LOGGER.isEnabledFor(logging.DEBUG):
+            return _Stage(self, name)
+        return _NOOP
+
+    def record(self, name, ms):
+        self.last[name] = ms
+        self._total[name] = self._total.get(name, 0) + ms
+        self._count[name] = self._count.get(name, 0) + 1
+
+    def as_dict(self):
+        return {
+            name: {
+                "last_ms": round(self.last[name], 3),
+                "avg_ms": round(self._total[name] / count, 3),
+                "count": count,
+            }
+            for name, count in self._count.items()
+        }
+
+
+def get_lookup_timings(hass):
+    """Timings of the street_id lookups, shared by the config flow and entries."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if "lookup_timings" not in domain_data:
+        domain_data["lookup_timings"] = StageTimings()
+    return domain_data["lookup_timings"]
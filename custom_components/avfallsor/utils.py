@@ -1,17 +1,39 @@
+import asyncio
 import json
 import logging
+import os
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 import re
+from time import monotonic
 
-from itertools import chain
+from typing import NamedTuple
 
 import voluptuous as vol
-from bs4 import BeautifulSoup
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.util import dt as dt_util
+
+from .cache import (
+    ERROR_NOT_IN_NORWAY,
+    address_key,
+    async_get_cache,
+    lat_lon_key,
+)
+from .fetch import UnexpectedStatus, fetch
+from .parser import PickupDaysStream, parse_pickup_days
+from .timing import get_lookup_timings
 
 _LOGGER = logging.getLogger(__name__)
 
+AVFALLSOR_HOST = "avfallsor.no"
+GEONORGE_HOST = "ws.geonorge.no"
+# Set these before ha starts to use another server, like the stand-in in
+# benchmarks/standin_server.py.
+AVFALLSOR_URL = os.environ.get("AVFALLSOR_URL", f"https://{AVFALLSOR_HOST}").rstrip("/")
+GEONORGE_URL = os.environ.get("GEONORGE_URL", f"https://{GEONORGE_HOST}").rstrip("/")
+
 pattern = re.compile(
     r"""
     (?P<weekday>\w+\s)?        # Optional weekday (e.g. "Fredag ")
@@ -82,6 +104,78 @@ def parse_date(date_str: str, year=None):
         return res
 
 
+@lru_cache(maxsize=1024)
+def _parse_heading(heading):
+    """Fredag 7. mars -> (7, 3, None), the year is None if it is not in the heading.
+
+    The same headings show up for every address and every refresh, so the
+    results are kept.
+    """
+    match = pattern.match(heading.lower())
+    if match is None:
+        return None
+    month = months_no.get(match.group("month"))
+    if month is None:
+        return None
+    year = match.group("year")
+    if year is not None:
+        year = int(year)
+        if year < 100:
+            year += 2000
+    return int(match.group("day")), month, year
+
+
+def _nearest_year(day, month, today):
+    """The year that puts day.month closest to today."""
+    best = None
+    for year in (today.year - 1, today.year, today.year + 1):
+        try:
+            distance = abs(date(year, month, day) - today)
+        except ValueError:
+            # 29. februar
+            continue
+        if best is None or distance < best[0]:
+            best = (distance, year)
+    return best[1] if best else today.year
+
+
+class HeadingDates:
+    """Turns the calendar headings into dates, one heading at a time in page order.
+
+    The headings have no year, but the page lists the pickups in order, so
+    the year is bumped every time the date goes backwards (desember ->
+    januar). The first heading gets the year that puts it closest to today.
+    A year in the heading is used as is.
+    """
+
+    def __init__(self, today=None):
+        today = today or datetime.now()
+        self._today = today.date() if isinstance(today, datetime) else today
+        self._year = None
+        self._last = None
+
+    def __call__(self, heading):
+        parsed = _parse_heading(heading)
+        if parsed is None:
+            _LOGGER.debug("Could not parse the date %r", heading)
+            return None
+
+        day, month, year = parsed
+        if year is not None:
+            self._year = year
+        elif self._year is None:
+            self._year = _nearest_year(day, month, self._today)
+        elif (month, day) < self._last:
+            self._year += 1
+        self._last = (month, day)
+
+        try:
+            return datetime(self._year, month, day)
+        except ValueError:
+            _LOGGER.debug("%r is not a valid date in %s", heading, self._year)
+            return None
+
+
 def check_settings(config, hass):
     if not any(config.get(i) for i in ["street_id"]):
         _LOGGER.debug("street_id was not set")
@@ -113,49 +207,194 @@ def find_next_garbage_pickup(dates):
     return None
 
 
-def check_tomme_kalender(data):
-    tomme_kalender = parse_tomme_kalender(data)
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def epoch_day(day=None):
+    """Days since 1970-01-01 of a date or datetime, default today. 2025-03-07 -> 20154"""
+    if day is None:
+        day = dt_util.now()
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.toordinal() - EPOCH
+
+
+def from_epoch_day(day):
+    """20154 -> date(2025, 3, 7)"""
+    return date.fromordinal(day + EPOCH)
+
+
+def _epoch_datetime(day):
+    """20154 -> datetime(2025, 3, 7), what PickupIndex hands out."""
+    return datetime.fromordinal(day + EPOCH)
+
+
+class PickupIndex:
+    """Sorted pickup days per garbage type.
+
+    The days are kept as epoch days in a array of ints, a few bytes per
+    pickup instead of a datetime object, so thousands of addresses in bulk
+    mode is fine. The index is built once per fetch and never changed, a
+    refresh builds a new index and replaces the old one.
+    """
+
+    __slots__ = ("_days",)
+
+    def __init__(self, tomme_kalender=None):
+        tomme_kalender = tomme_kalender or {}
+        self._days = {
+            gbt: array("i", sorted({epoch_day(d) for d in dates if d is not None}))
+            for gbt, dates in tomme_kalender.items()
+        }
+
+    def __bool__(self):
+        return any(self._days.values())
+
+    @property
+    def garbage_types(self):
+        return list(self._days)
+
+    @property
+    def last_pickup(self):
+        """The last pickup we know about for any garbage type, or None."""
+        last = max((days[-1] for days in self._days.values() if days), default=None)
+        return None if last is None else _epoch_datetime(last)
+
+    def counts(self):
+        """Get {garbage_type: number of pickups}, without making the datetimes."""
+        return {gbt: len(days) for gbt, days in self._days.items()}
+
+    def as_dict(self):
+        """Get {garbage_type: [datetime, ...]} like parse_tomme_kalender."""
+        return {
+            gbt: [_epoch_datetime(day) for day in days]
+            for gbt, days in self._days.items()
+        }
+
+    def has_pickup(self, garbage_type, day):
+        """Check if garbage_type is picked up on day."""
+        days = self._days.get(garbage_type, ())
+        day = epoch_day(day)
+        i = bisect_left(days, day)
+        return i < len(days) and days[i] == day
+
+    def next_pickups(self, garbage_type, count, after=None):
+        """Get the next count pickups on or after the day after (default today)."""
+        days = self._days.get(garbage_type, ())
+        start = bisect_left(days, epoch_day(after))
+        return [_epoch_datetime(day) for day in days[start : start + count]]
+
+    def next_pickup(self, garbage_type, after=None):
+        """Get the next pickup on or after the day after (default today)."""
+        days = self._days.get(garbage_type, ())
+        i = bisect_left(days, epoch_day(after))
+        if i < len(days):
+            return _epoch_datetime(days[i])
+        return None
+
+    def pickups(self, start=None, end=None):
+        """All the pickups as (datetime, garbage_type) sorted by day, [start, end) if set."""
+        start = epoch_day(start) if start is not None else None
+        end = epoch_day(end) if end is not None else None
+        result = []
+        for gbt, days in self._days.items():
+            first = bisect_left(days, start) if start is not None else 0
+            last = bisect_left(days, end) if end is not None else len(days)
+            result.extend((day, gbt) for day in days[first:last])
+        result.sort()
+        return [(_epoch_datetime(day), gbt) for day, gbt in result]
+
+
+class HostRateLimiter:
+    """Spaces out the requests to each host so we get at most rate per second."""
+
+    def __init__(self, rate):
+        self._interval = 1 / rate
+        self._next = {}
+
+    async def acquire(self, host):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self._next.get(host, now))
+        # Reserve the slot before we sleep so the next caller queues after us.
+        self._next[host] = start + self._interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class HostCircuitBreaker:
+    """Stops the requests to a host that keeps failing.
+
+    After threshold failures in a row the host is left alone for reset_after
+    seconds, then a single request is let through. If that works the host
+    is used as normal again, if not we wait another reset_after.
+    """
+
+    def __init__(self, threshold, reset_after):
+        self._threshold = threshold
+        self._reset_after = reset_after
+        self._failures = {}
+        self._opened = {}
+        self._trial = set()
+
+    def allow(self, host):
+        """Check if we may make a request to host now."""
+        opened = self._opened.get(host)
+        if opened is None:
+            return True
+        if host in self._trial or monotonic() - opened < self._reset_after:
+            return False
+        self._trial.add(host)
+        return True
 
-    if not any(len(i) > 1 for i in tomme_kalender.values()):
+    def retry_after(self, host):
+        """Seconds until a request to host is allowed, 0 if it is allowed now."""
+        opened = self._opened.get(host)
+        if opened is None:
+            return 0
+        return max(opened + self._reset_after - monotonic(), 0)
+
+    def record_success(self, host):
+        """Returns True if the host was failing until now."""
+        self._failures.pop(host, None)
+        self._trial.discard(host)
+        return self._opened.pop(host, None) is not None
+
+    def diagnostics(self):
+        return {
+            host: {
+                "failures": self._failures.get(host, 0),
+                "paused": host in self._opened,
+                "retry_after": round(self.retry_after(host), 1),
+            }
+            for host in {*self._failures, *self._opened}
+        }
+
+    def record_failure(self, host):
+        self._trial.discard(host)
+        failures = self._failures[host] = self._failures.get(host, 0) + 1
+        if failures >= self._threshold:
+            if host not in self._opened:
+                _LOGGER.warning("%s keeps failing, pausing requests to it", host)
+            self._opened[host] = monotonic()
+
+
+def valid_tomme_kalender(tomme_kalender):
+    """Check that a parsed tømmekalender has any pickups."""
+    return valid_pickup_counts({gbt: len(i) for gbt, i in tomme_kalender.items()})
+
+
+def valid_pickup_counts(counts):
+    """Like valid_tomme_kalender, for the counts of a PickupIndex."""
+    if not any(count > 1 for count in counts.values()):
         _LOGGER.debug("No tømmekalender is available")
         return False
     return True
 
 
-async def verify_that_we_can_find_id(config, hass):
-    client = async_get_clientsession(hass)
-
-    try:
-        # Check that we have some info we can use to find the tommeplan
-        # it might still fail if the user entered the wrong adresse etc.
-        check_settings(config, hass)
-    except vol.Invalid:
-        return False
-
-    try:
-        adr = await find_id(config.get("address"), client)
-        if adr:
-            return adr
-    except:
-        _LOGGER.exception("Failed to find the id")
-        pass
-
-    try:
-        adr = await find_id_from_lat_lon(
-            hass.config.latitude, hass.config.longitude, client
-        )
-        if adr:
-            return adr
-    except:
-        _LOGGER.exception("Failed to find the id from lat lon")
-        pass
-
-    return False
-
-
 async def find_id(address, client):
     """Find the id that avfall sør uses to create the tømmeplan"""
-    _LOGGER.debugs("Called find_id %r", address)
+    _LOGGER.debug("Called find_id %r", address)
     if not address:
         return
 
@@ -168,48 +407,103 @@ async def find_id(address, client):
         cleaned_address = address
 
     params = {"lookup_term": cleaned_address}
-    url = "https://avfallsor.no/wp-json/addresses/v1/address"
-    resp = await client.get(url, params=params)
-
+    url = f"{AVFALLSOR_URL}/wp-json/addresses/v1/address"
     _LOGGER.debug("Trying to find the id using url %s, params %s", url, params)
+    resp = await fetch(client, url, params=params)
+    if resp.status != 200:
+        # Not a miss, so it must not be cached as one.
+        raise UnexpectedStatus(f"{url} returned {resp.status}")
 
-    if resp.status == 200:
-        data = await resp.json()
+    # Decode in the executor, the response can be big for short lookup terms.
+    data = await asyncio.get_running_loop().run_in_executor(None, json.loads, resp.body)
 
+    if _LOGGER.isEnabledFor(logging.DEBUG):
+        # Don't pretty print the response unless someone will read it.
         _LOGGER.debug("Raw response:\n\n %s", json.dumps(data, indent=4))
-        # Api returns a empty list if we dont get a hit.
-        if isinstance(data, list):
-            _LOGGER.warning("Didn't find address using %s", address)
-            return None
-
-        if len(data) > 1:
-            _LOGGER.warning(
-                "We got multiple adresses, consider extracting the id manually or adding the municipality"
-            )
+    # Api returns a empty list if we dont get a hit.
+    if isinstance(data, list):
+        _LOGGER.warning("Didn't find address using %s", address)
+        return None
+
+    if len(data) > 1:
+        _LOGGER.warning(
+            "We got multiple adresses, consider extracting the id manually or adding the municipality"
+        )
 
-        for key, value in data.items():
-            # To handle the old format
-            # Kongeveien 1, Kristiansand
-            if "," in address:
-                wanted_key = "label"
-            else:
-                wanted_key = "value"
-            if value[wanted_key].lower() == address.lower():
-                return value["href"].split("/")[-1]
+    for key, value in data.items():
+        # To handle the old format
+        # Kongeveien 1, Kristiansand
+        if "," in address:
+            wanted_key = "label"
+        else:
+            wanted_key = "value"
+        if value[wanted_key].lower() == address.lower():
+            return value["href"].split("/")[-1]
 
     return None
 
 
-async def get_tommeplan_page(street_id, client) -> str:
-    """Get the tommeplan page as text"""
-    url = (
-        f"https://avfallsor.no/henting-av-avfall/finn-hentedag/{street_id.strip('/')}/"
-    )
+class TommeplanPage(NamedTuple):
+    """Result of fetch_tommeplan_page, text is None if the page is not modified.
+
+    If the page was streamed text is only the start of the page, up to the
+    end of the calendar, and items is what the parser found in it (None if
+    the calendar has to be parsed again from text).
+    """
+
+    text: str | None
+    etag: str | None
+    last_modified: str | None
+    items: list | None = None
+    # Bytes read.
+    size: int | None = None
+
+    @property
+    def not_modified(self):
+        return self.text is None
+
+
+async def fetch_tommeplan_page(
+    street_id, client, etag=None, last_modified=None, stream=False
+):
+    """Get the tommeplan page, using a conditional request if we have validators.
+
+    With stream the calendar is parsed as the page arrives and we stop
+    reading when we have it. Returns None if there is no page for the
+    street_id, a error from the site raises UnexpectedStatus.
+    """
+    url = f"{AVFALLSOR_URL}/henting-av-avfall/finn-hentedag/{street_id.strip('/')}/"
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
     _LOGGER.debug("Getting the tomme plan page %s", url)
-    resp = await client.get(url)
-    if resp.status == 200:
-        text = await resp.text()
-        return text
+    pickup_stream = PickupDaysStream() if stream else None
+    resp = await fetch(client, url, headers=headers, stream=pickup_stream)
+    if resp.status == 304:
+        return TommeplanPage(None, etag, last_modified)
+    if resp.status >= 500:
+        raise UnexpectedStatus(f"{url} returned {resp.status}")
+    if resp.status != 200:
+        return None
+
+    new_etag = resp.headers.get("ETag")
+    new_last_modified = resp.headers.get("Last-Modified")
+    if pickup_stream is None:
+        return TommeplanPage(
+            resp.text, new_etag, new_last_modified, size=len(resp.body)
+        )
+
+    pickup_stream.close()
+    return TommeplanPage(
+        pickup_stream.text,
+        new_etag,
+        new_last_modified,
+        pickup_stream.items,
+        pickup_stream.size,
+    )
 
 
 async def find_address_from_lat_lon(lat, lon, client):
@@ -219,10 +513,10 @@ async def find_address_from_lat_lon(lat, lon, client):
 
     _LOGGER.debug("Trying to find the address using lat %s lon %s", lat, lon)
 
-    url = f"https://ws.geonorge.no/adresser/v1/punktsok?lon={lon}&lat={lat}&radius=20"
-    resp = await client.get(url)
+    url = f"{GEONORGE_URL}/adresser/v1/punktsok?lon={lon}&lat={lat}&radius=20"
+    resp = await fetch(client, url)
     if resp.status == 200:
-        result = await resp.json()
+        result = json.loads(resp.body)
         res = result.get("adresser", [])
         if res:
             # The first one seems to be the most correct.
@@ -232,9 +526,11 @@ async def find_address_from_lat_lon(lat, lon, client):
             )
             return "%s" % (res["adressetekstutenadressetilleggsnavn"])
     elif resp.status == 400:
-        result = await resp.json()
+        result = json.loads(resp.body)
         _LOGGER.info("Api returned 400, error %s", result.get("message", ""))
         raise ValueError("lat and lon is not in Norway.")
+    else:
+        raise UnexpectedStatus(f"{url} returned {resp.status}")
 
 
 async def find_id_from_lat_lon(lat, lon, client):
@@ -243,49 +539,91 @@ async def find_id_from_lat_lon(lat, lon, client):
     return await find_id(address, client)
 
 
-def parse_tomme_kalender(text):
-    final = defaultdict(list)
-    soup = BeautifulSoup(text, "html5lib")
-    calendar_div = soup.select_one("div.pickup-days-large")
+async def _cached_lookup(key, lookup, hass):
+    """Run lookup unless key is cached, a None from lookup is cached as a miss.
+
+    lookup must raise if it did not get a answer, so a outage is not
+    remembered as a address we can't find.
+    """
+    cache = await async_get_cache(hass)
+    entry = cache.get_street_id(key)
+    if entry is None:
+        try:
+            with get_lookup_timings(hass).stage(key.split(":")[0] + "_lookup"):
+                street_id = await lookup()
+        except ValueError:
+            cache.async_set_street_id(key, None, ERROR_NOT_IN_NORWAY)
+            raise
+        except Exception:
+            # Use what we found last time if they are having problems.
+            entry = cache.get_street_id(key, allow_expired=True)
+            if entry is None or not entry["street_id"]:
+                raise
+            _LOGGER.warning("Failed to look up %s, using the old street_id", key)
+            return entry["street_id"]
+
+        cache.async_set_street_id(key, street_id)
+        return street_id
+
+    _LOGGER.debug("Using cached street_id %s for %s", entry["street_id"], key)
+    if entry["error"] == ERROR_NOT_IN_NORWAY:
+        raise ValueError("lat and lon is not in Norway.")
+    return entry["street_id"]
+
+
+async def find_id_cached(address, client, hass):
+    """find_id, but the result is remembered so we only ask once per ttl."""
+    if not address:
+        return
+    return await _cached_lookup(
+        address_key(address), lambda: find_id(address, client), hass
+    )
+
+
+async def find_id_from_lat_lon_cached(lat, lon, client, hass):
+    """find_id_from_lat_lon, but the result is remembered so we only ask once per ttl."""
+    if lat is None or lon is None:
+        return
+    return await _cached_lookup(
+        lat_lon_key(lat, lon), lambda: find_id_from_lat_lon(lat, lon, client), hass
+    )
+
 
+def pickup_calendar(items, today=None):
+    """Turn the (tag, value) items from the parser into {garbage_type: [datetime, ...]}"""
     result = defaultdict(list)
-    date = None
+    seen = set()
+    pickup_date = None
 
     # We need to use a naive approch here as the html structure sucks
     # Avfallsors implementation does not show old pickup dates after todays date and year is missing
-    # so we have to do some guess work.
-    today = datetime.today()
-    for item in calendar_div:
-        if item.name == "h3":
-            date = item.get_text(strip=True)
-            date = parse_date(date)
-            # We check if todays date is greater than the date in html, and if it is we will increment the year
-            # as old dates are not showed.
-            if today > date:
-                date = parse_date(item.get_text(strip=True), year=date.year + 1)
-
-        elif item.name == "div":
-            classes = []
-            span_classes = item.find_all(class_="waste-icon")
-            if span_classes:
-                for span in span_classes:
-                    for s in span["class"]:
-                        # Just want to skip this one as it not needed.
-                        if s == "waste-icon":
-                            continue
-                        elif "--" in s:
-                            classes.append(s.split("--")[1])
-            result[date].extend(classes)
-
-    # The old implementation expects {garbagetype: [datetime.date...]} so we need to make it compatible.
-    final = defaultdict(list)
-    garbage_types = set(chain.from_iterable(result.values()))
-
-    for trash in garbage_types:
-        for key, value in result.items():
-            if trash in value:
-                final[trash].append(key)
-
-    _LOGGER.debug("%r" % final)
-
-    return final
+    # so we have to do some guess work, see HeadingDates.
+    heading_date = HeadingDates(today)
+    for tag, value in items:
+        if tag == "h3":
+            pickup_date = heading_date(value)
+
+        elif tag == "div" and pickup_date is not None:
+            # The old implementation expects {garbagetype: [datetime.date...]}
+            # so we build that directly, a date is only added once per type.
+            for trash in value:
+                if (pickup_date, trash) not in seen:
+                    seen.add((pickup_date, trash))
+                    result[trash].append(pickup_date)
+
+    _LOGGER.debug("%r", result)
+
+    return result
+
+
+def parse_tomme_kalender(text, backend=None, today=None):
+    """Parse the tømmeplan page into {garbage_type: [datetime, ...]}
+
+    See parser.parse_pickup_days for the backend options.
+    """
+    return pickup_calendar(parse_pickup_days(text, backend=backend), today)
+
+
+def parse_pickup_index(text, backend=None):
+    """Parse the tømmeplan page into a PickupIndex."""
+    return PickupIndex(parse_tomme_kalender(text, backend=backend))
@@ -0,0 +1,114 @@
+"""The timeouts, size caps and latency histograms of fetch.
+
+Runs against a local aiohttp server:
+
+    python -m pytest tests
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT))
+
+from custom_components.avfallsor import fetch
+
+HOST = "127.0.0.1"
+BODY = b"x" * 1000
+
+
+async def slow(request):
+    await asyncio.sleep(5)
+    return web.Response(body=BODY)
+
+
+async def sized(request):
+    return web.Response(body=BODY)
+
+
+async def chunked(request):
+    # No content-length, the cap has to be checked while reading.
+    resp = web.StreamResponse()
+    resp.enable_chunked_encoding()
+    await resp.prepare(request)
+    for _ in range(10):
+        await resp.write(BODY)
+    await resp.write_eof()
+    return resp
+
+
+def run(path, **kwargs):
+    """Start the server, fetch path from it and stop the server again."""
+
+    async def go():
+        app = web.Application()
+        app.router.add_get("/slow", slow)
+        app.router.add_get("/sized", sized)
+        app.router.add_get("/chunked", chunked)
+        async with (
+            TestServer(app, host=HOST) as server,
+            aiohttp.ClientSession() as client,
+        ):
+            return await fetch.fetch(client, str(server.make_url(path)), **kwargs)
+
+    return asyncio.run(go())
+
+
+@pytest.fixture(autouse=True)
+def histograms():
+    fetch.reset_latency()
+    try:
+        import pytest_socket
+    except ImportError:
+        pass
+    else:
+        # The Home Assistant test plugin blocks sockets, the server is local.
+        pytest_socket.enable_socket()
+    yield
+    fetch.reset_latency()
+
+
+def test_timeout_raises_timeout_error():
+    with pytest.raises(TimeoutError):
+        run("/slow", timeout=aiohttp.ClientTimeout(total=0.2))
+    histogram = fetch.latency_histogram(HOST)
+    assert histogram.timeouts == 1
+    assert histogram.count == 0
+
+
+def test_content_length_over_max_size():
+    # Raised from the header, before any of the body is read.
+    with pytest.raises(fetch.ResponseTooLarge, match=f"is {len(BODY)} bytes"):
+        run("/sized", max_size=len(BODY) - 1)
+    assert fetch.latency_histogram(HOST).errors == 1
+
+
+def test_streamed_body_over_max_size():
+    with pytest.raises(fetch.ResponseTooLarge, match="is over"):
+        run("/chunked", max_size=len(BODY) * 5)
+    assert fetch.latency_histogram(HOST).errors == 1
+
+
+def test_body_at_max_size():
+    resp = run("/chunked", max_size=len(BODY) * 10)
+    assert resp.status == 200
+    assert resp.body == BODY * 10
+
+
+def test_histogram_is_updated():
+    run("/sized")
+    run("/sized")
+    histogram = fetch.latency_histogram(HOST)
+    assert histogram.count == 2
+    assert sum(histogram.counts) == 2
+    stats = fetch.latency_diagnostics()[HOST]
+    assert stats["count"] == 2
+    assert sum(stats["buckets"].values()) == 2
+    assert stats["p50_ms"] is not None or histogram.counts[-1] == 2
@@ -0,0 +1,94 @@
+"""The fast parser must give the same pickup days as the tree builders.
+
+Runs over the recorded pages in benchmarks/fixtures:
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = ROOT / "benchmarks" / "fixtures"
+
+sys.path.insert(0, str(ROOT))
+
+from custom_components.avfallsor import parser
+
+PAGES = sorted(path.stem for path in FIXTURES.glob("tommeplan*.html"))
+TREE_BUILDERS = [parser.BACKEND_HTML5LIB] + (
+    [parser.BACKEND_LXML] if parser.HAS_LXML else []
+)
+# Chunk sizes the streaming parser must give the same result for.
+CHUNK_SIZES = [1, 7, 1024, 16 * 1024]
+
+ICON = '<div><span class="waste-icon waste-icon--{}"></span></div>'
+# Markup the fast parser can't read the same way as a browser, it has to
+# give up on these so a tree builder is used.
+TRICKY = {
+    "h3_in_p": f"<p><h3>Fredag 7. mars</h3></p>{ICON.format('bio')}",
+    "div_in_p": f"<h3>Fredag 7. mars</h3><p>{ICON.format('bio')}</p>",
+    "marked_section": f"<h3>Fredag 7. mars</h3><![foo[ x ]]>{ICON.format('bio')}",
+    "h3_in_h3": f"<h3>Fredag <h3>7. mars</h3></h3>{ICON.format('paper')}",
+    "stray_end_tag": f"<h3>Fredag 7. mars</span></h3>{ICON.format('bio')}",
+    "unclosed_h3_in_h3": f"<h3>Fredag<h3>7. mars</h3>{ICON.format('paper')}",
+    "self_closing_div": f"<h3>Fredag 7. mars</h3><div/>{ICON.format('bio')}",
+    "self_closing_icon": (
+        '<h3>Fredag 7. mars</h3><div><span class="waste-icon waste-icon--bio"/>'
+        f"</div>{ICON.format('paper')}"
+    ),
+}
+
+
+def read_page(name):
+    return (FIXTURES / f"{name}.html").read_text(encoding="utf-8")
+
+
+def calendar_page(block):
+    return f'<main><div class="pickup-days-large">{block}</div></main>'
+
+
+def stream_items(text, chunk_size):
+    body = text.encode("utf-8")
+    stream = parser.PickupDaysStream()
+    for start in range(0, len(body), chunk_size):
+        if stream.feed(body[start : start + chunk_size]):
+            break
+    stream.close()
+    if stream.items is not None:
+        return stream.items
+    return parser.parse_pickup_days(stream.text)
+
+
+@pytest.mark.parametrize("backend", TREE_BUILDERS)
+@pytest.mark.parametrize("page", PAGES)
+def test_fixture_matches_tree_builder(page, backend):
+    text = read_page(page)
+    assert parser.parse_pickup_days(text) == parser.parse_pickup_days(
+        text, backend=backend
+    )
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("page", PAGES)
+def test_fixture_streamed(page, chunk_size):
+    text = read_page(page)
+    assert stream_items(text, chunk_size) == parser.parse_pickup_days(text)
+
+
+@pytest.mark.parametrize("name", sorted(TRICKY))
+def test_tricky_markup_is_malformed(name):
+    text = calendar_page(TRICKY[name])
+    assert parser._parse_fast(text).malformed
+    assert parser.parse_pickup_days(text) == parser.parse_pickup_days(
+        text, backend=parser.BACKEND_HTML5LIB
+    )
+
+
+@pytest.mark.parametrize("name", sorted(TRICKY))
+def test_tricky_markup_streamed(name):
+    text = calendar_page(TRICKY[name])
+    for chunk_size in CHUNK_SIZES:
+        assert stream_items(text, chunk_size) == parser.parse_pickup_days(text)